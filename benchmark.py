@@ -0,0 +1,328 @@
+"""Suite de benchmarks de las etapas de procesamiento con datos sintéticos
+
+Uso:
+    python benchmark.py [opciones]
+    python benchmark.py --salida base.json
+    python benchmark.py --salida nuevo.json --comparar base.json
+
+Genera sin conexión una serie DICOM (cortes, matriz y profundidad de bits
+configurables, con los archivos en orden distinto al de SliceLocation) y una
+imagen grande en PNG y JPG. Mide el tiempo (de reloj y de CPU) y la memoria
+pico de cada etapa de clases.py y guarda los resultados en JSON. Con
+--comparar se contrasta contra una ejecución anterior y se marcan como
+regresión las etapas cuyo tiempo crece más que la tolerancia.
+
+La memoria se mide en una ejecución aparte con tracemalloc (numpy y OpenCV
+reservan a través de él solo en parte, por eso también se informa el RSS
+máximo del proceso), para que el rastreo no altere los tiempos.
+"""
+import matplotlib
+matplotlib.use('Agg')
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+from clases import (CatalogoDICOM, ProcesadorDICOM, ProcesadorImagenes, Proyecciones, RenderizadorPNG,
+                    Segmentacion3D, VolumenCompartido)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def generar_serie_dicom(carpeta, cortes=64, filas=256, columnas=256, bits=12, barajar=True, semilla=0):
+    """Escribe una serie DICOM sintética (un elipsoide con ruido) en la carpeta
+
+    Con barajar=True los nombres de archivo no siguen el orden de SliceLocation,
+    así que la reconstrucción tiene que ordenar los cortes.
+    """
+    os.makedirs(carpeta, exist_ok=True)
+    rng = np.random.default_rng(semilla)
+    bits_asignados = 8 if bits <= 8 else 16
+    tipo = np.uint8 if bits_asignados == 8 else np.uint16
+    maximo = 2 ** bits - 1
+
+    orden_archivos = rng.permutation(cortes) if barajar else np.arange(cortes)
+    serie_uid = generate_uid()
+    estudio_uid = generate_uid()
+    espesor = 1.5
+    y, x = np.mgrid[-1:1:filas * 1j, -1:1:columnas * 1j]
+
+    for i in range(cortes):
+        z = 2 * i / max(cortes - 1, 1) - 1
+        # Elipsoide con un "núcleo" más brillante y ruido gaussiano
+        fondo = (x / 0.8) ** 2 + (y / 0.9) ** 2 + (z / 0.95) ** 2 <= 1
+        nucleo = (x / 0.3) ** 2 + (y / 0.4) ** 2 + (z / 0.5) ** 2 <= 1
+        corte = 0.35 * fondo + 0.4 * nucleo + rng.normal(0, 0.03, fondo.shape)
+        pixeles = np.clip(corte * maximo, 0, maximo).astype(tipo)
+
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = MRImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID = MRImageStorage
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.StudyInstanceUID = estudio_uid
+        ds.SeriesInstanceUID = serie_uid
+        ds.SeriesDescription = 'Serie sintetica de benchmark'
+        ds.Modality = 'MR'
+        ds.PatientName = 'Benchmark^Sintetico'
+        ds.PatientID = 'BENCH001'
+        ds.PatientAge = '040Y'
+        ds.PatientSex = 'O'
+        ds.InstanceNumber = i + 1
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.ImagePositionPatient = [0, 0, i * espesor]
+        ds.SliceLocation = i * espesor
+        ds.SliceThickness = espesor
+        ds.PixelSpacing = [1, 1]
+        ds.Rows = filas
+        ds.Columns = columnas
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.BitsAllocated = bits_asignados
+        ds.BitsStored = bits
+        ds.HighBit = bits - 1
+        ds.PixelRepresentation = 0
+        ds.PixelData = pixeles.tobytes()
+        ds.save_as(os.path.join(carpeta, f"corte_{orden_archivos[i]:04d}.dcm"), enforce_file_format=True)
+
+
+def generar_imagen(ruta, alto=4096, ancho=4096, semilla=0):
+    """Escribe una imagen sintética a color (células sobre fondo con ruido) en PNG o JPG"""
+    rng = np.random.default_rng(semilla)
+    imagen = rng.normal(60, 12, (alto, ancho, 3)).clip(0, 255).astype(np.uint8)
+    for _ in range(max(1, alto * ancho // 40000)):
+        centro = (int(rng.integers(0, ancho)), int(rng.integers(0, alto)))
+        radio = int(rng.integers(5, 40))
+        color = tuple(int(c) for c in rng.integers(120, 255, 3))
+        cv2.circle(imagen, centro, radio, color, -1)
+    cv2.imwrite(ruta, imagen)
+
+
+def _rss_maximo():
+    """RSS máximo del proceso en bytes (ru_maxrss está en KB en Linux y en bytes en macOS)"""
+    if resource is None:
+        return None
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo if sys.platform == 'darwin' else maximo * 1024
+
+
+def medir(nombre, funcion, preparar=None, repeticiones=3):
+    """Tiempo y memoria de una etapa
+
+    `preparar` se ejecuta antes de cada repetición, fuera de la medición, y su
+    resultado se pasa a `funcion`. Devuelve el registro de la etapa y el
+    resultado de la última ejecución.
+    """
+    tiempos = []
+    tiempos_cpu = []
+    resultado = None
+    for _ in range(repeticiones):
+        argumento = preparar() if preparar else None
+        inicio, inicio_cpu = time.perf_counter(), time.process_time()
+        resultado = funcion(argumento) if preparar else funcion()
+        tiempos.append(time.perf_counter() - inicio)
+        tiempos_cpu.append(time.process_time() - inicio_cpu)
+        del argumento
+
+    # Ejecución aparte con tracemalloc para la memoria pico
+    argumento = preparar() if preparar else None
+    tracemalloc.start()
+    funcion(argumento) if preparar else funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del argumento
+
+    registro = {
+        'etapa': nombre,
+        'repeticiones': repeticiones,
+        'tiempo_min': min(tiempos),
+        'tiempo_mediana': statistics.median(tiempos),
+        'tiempo_cpu_mediana': statistics.median(tiempos_cpu),
+        'memoria_pico_bytes': pico,
+        'rss_maximo_bytes': _rss_maximo()
+    }
+    print(f"{nombre:<32}{registro['tiempo_mediana']:>10.4f} s{registro['tiempo_cpu_mediana']:>10.4f} s"
+          f"{pico / 2 ** 20:>10.1f} MB")
+    return registro, resultado
+
+
+def ejecutar(configuracion):
+    """Genera los datos (si hace falta) y mide todas las etapas"""
+    directorio = configuracion['datos'] or tempfile.mkdtemp(prefix='benchmark_parcial3_')
+    carpeta_dicom = os.path.join(directorio, 'dicom')
+    ruta_png = os.path.join(directorio, 'imagen.png')
+    ruta_jpg = os.path.join(directorio, 'imagen.jpg')
+    ruta_figura = os.path.join(directorio, 'cortes.png')
+    ruta_montaje = os.path.join(directorio, 'montaje.png')
+    repeticiones = configuracion['repeticiones']
+
+    if not os.path.isdir(carpeta_dicom) or not os.listdir(carpeta_dicom):
+        print(f"Generando serie DICOM sintética en {carpeta_dicom}...")
+        generar_serie_dicom(carpeta_dicom, configuracion['cortes'], configuracion['filas'],
+                            configuracion['columnas'], configuracion['bits'], configuracion['barajar'])
+    for ruta in (ruta_png, ruta_jpg):
+        if not os.path.exists(ruta):
+            print(f"Generando imagen sintética {ruta}...")
+            generar_imagen(ruta, configuracion['lado_imagen'], configuracion['lado_imagen'])
+
+    print(f"\n{'etapa':<32}{'mediana':>12}{'CPU':>12}{'memoria':>13}")
+    resultados = []
+
+    def registrar(nombre, funcion, preparar=None):
+        registro, resultado = medir(nombre, funcion, preparar, repeticiones)
+        resultados.append(registro)
+        return resultado
+
+    def cargar():
+        return ProcesadorDICOM.cargar_carpeta_dicom(carpeta_dicom)
+
+    archivos_dicom, _ = registrar('cargar_carpeta_dicom', cargar)
+    # Catálogo de cabeceras: escaneo completo (base nueva en cada repetición) y reescaneo sin cambios
+    ruta_catalogo = os.path.join(directorio, 'catalogo.sqlite')
+
+    def catalogo_nuevo():
+        for sufijo in ('', '-wal', '-shm'):
+            if os.path.exists(ruta_catalogo + sufijo):
+                os.remove(ruta_catalogo + sufijo)
+        return CatalogoDICOM(ruta_catalogo)
+
+    def escanear(catalogo):
+        catalogo.actualizar(carpeta_dicom)
+        catalogo.cerrar()
+
+    registrar('catalogo_escaneo', escanear, preparar=catalogo_nuevo)
+    catalogo = CatalogoDICOM(ruta_catalogo)
+    registrar('catalogo_reescaneo', lambda: catalogo.actualizar(carpeta_dicom))
+    catalogo.cerrar()
+    registrar('cargar_carpeta_dicom_paralelo',
+              lambda: ProcesadorDICOM.cargar_carpeta_dicom(carpeta_dicom, paralelo=True))
+    # Cada repetición reconstruye desde datasets recién leídos (sin pixeles decodificados)
+    volumen_3d = registrar('reconstruir_3d', ProcesadorDICOM.reconstruir_3d,
+                           preparar=lambda: cargar()[0])
+    registrar('mostrar_cortes', lambda: ProcesadorDICOM.mostrar_cortes(volumen_3d, ruta_salida=ruta_figura))
+
+    registrar('montaje', lambda: RenderizadorPNG.montaje(volumen_3d, ruta_montaje))
+    registrar('proyeccion_mip', lambda: Proyecciones.proyectar(volumen_3d, 'mip'))
+    registrar('plano_oblicuo_losa', lambda: Proyecciones.plano_oblicuo(volumen_3d, rotacion_grados=(30, 0, 0),
+                                                                      grosor=10))
+    # Umbral en la mitad del rango almacenado, apertura 3x3x3 y etiquetado 26-conexo por bloques
+    umbral = float(volumen_3d.max()) / 2
+    registrar('segmentacion_3d', lambda: Segmentacion3D.segmentar(volumen_3d, '1', umbral, 3))
+
+    corte_central = volumen_3d[volumen_3d.shape[0] // 2]
+    registrar('trasladar_imagen', lambda: ProcesadorDICOM.trasladar_imagen(corte_central, 50, 30))
+    # Mismo trabajo por corte en un pool de hilos y en un pool de procesos con memoria compartida
+    traslacion = np.float32([[1, 0, 50], [0, 1, 30]])
+    registrar('transformar_volumen_hilos', lambda: ProcesadorDICOM.transformar_volumen(volumen_3d, traslacion))
+    compartido = VolumenCompartido.desde(volumen_3d)
+    registrar('transformar_volumen_procesos',
+              lambda: ProcesadorDICOM.transformar_volumen(compartido, traslacion).liberar())
+    compartido.liberar()
+
+    imagen = registrar('cargar_imagen_png', lambda: ProcesadorImagenes.cargar_imagen(ruta_png))
+    registrar('cargar_imagen_jpg', lambda: ProcesadorImagenes.cargar_imagen(ruta_jpg))
+    binarizada = registrar('binarizar_imagen', lambda: ProcesadorImagenes.binarizar_imagen(imagen, '1', 127))
+    morfologica = registrar('aplicar_morfologia',
+                            lambda: ProcesadorImagenes.aplicar_morfologia(binarizada, configuracion['kernel_size']))
+    registrar('dibujar_forma_con_texto',
+              lambda: ProcesadorImagenes.dibujar_forma_con_texto(morfologica, 'circulo', "Imagen binarizada",
+                                                                 127, configuracion['kernel_size']))
+
+    if not configuracion['datos']:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'plataforma': {
+            'python': platform.python_version(),
+            'sistema': platform.platform(),
+            'procesadores': os.cpu_count(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'pydicom': pydicom.__version__
+        },
+        'configuracion': configuracion,
+        'resultados': resultados
+    }
+
+
+def comparar(actual, anterior, tolerancia):
+    """Imprime la razón de tiempos contra una ejecución anterior y devuelve las regresiones"""
+    previos = {registro['etapa']: registro for registro in anterior['resultados']}
+    regresiones = []
+    print(f"\n{'etapa':<32}{'anterior':>11}{'actual':>11}{'razón':>8}")
+    for registro in actual['resultados']:
+        previo = previos.get(registro['etapa'])
+        if previo is None or not previo['tiempo_mediana']:
+            continue
+        razon = registro['tiempo_mediana'] / previo['tiempo_mediana']
+        marca = ''
+        if razon > 1 + tolerancia:
+            marca = '  REGRESIÓN'
+            regresiones.append(registro['etapa'])
+        print(f"{registro['etapa']:<32}{previo['tiempo_mediana']:>11.4f}{registro['tiempo_mediana']:>11.4f}"
+              f"{razon:>8.2f}{marca}")
+    return regresiones
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de las etapas de procesamiento")
+    parser.add_argument('--cortes', type=int, default=64, help="Cortes de la serie DICOM")
+    parser.add_argument('--filas', type=int, default=256, help="Filas de cada corte")
+    parser.add_argument('--columnas', type=int, default=256, help="Columnas de cada corte")
+    parser.add_argument('--bits', type=int, default=12, choices=(8, 12, 16), help="Bits almacenados")
+    parser.add_argument('--sin-barajar', dest='barajar', action='store_false',
+                        help="Nombrar los archivos en el orden de SliceLocation")
+    parser.add_argument('--lado-imagen', type=int, default=4096, help="Lado de la imagen PNG/JPG")
+    parser.add_argument('--kernel-size', type=int, default=5, help="Kernel de la morfología")
+    parser.add_argument('--repeticiones', type=int, default=3, help="Repeticiones por etapa")
+    parser.add_argument('--datos', default=None,
+                        help="Carpeta para generar y reutilizar los datos sintéticos (por defecto, temporal)")
+    parser.add_argument('--salida', default=None, help="Archivo JSON de resultados")
+    parser.add_argument('--comparar', default=None, help="JSON de una ejecución anterior")
+    parser.add_argument('--tolerancia', type=float, default=0.2,
+                        help="Aumento relativo de tiempo que se considera regresión")
+    opciones = parser.parse_args(argumentos)
+
+    configuracion = {clave: valor for clave, valor in vars(opciones).items()
+                     if clave not in ('salida', 'comparar', 'tolerancia')}
+    resultado = ejecutar(configuracion)
+
+    if opciones.salida:
+        with open(opciones.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en: {opciones.salida}")
+
+    if opciones.comparar:
+        with open(opciones.comparar, encoding='utf-8') as f:
+            anterior = json.load(f)
+        regresiones = comparar(resultado, anterior, opciones.tolerancia)
+        if regresiones:
+            print(f"\nRegresiones: {', '.join(regresiones)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Comparación de tiempos: morfología de OpenCV vs. descomposición de Morfologia
+
+Uso:
+    python benchmark_morfologia.py [lado_imagen] [archivo_json]
+
+Para cada forma y tamaño de kernel se mide una erosión con cv2.erode y con
+Morfologia.aplicar forzando la descomposición (TAMANO_MINIMO_DESCOMPOSICION en 1).
+El costo de OpenCV crece con el área del kernel (elipse) o con su lado (cuadrado);
+el de la descomposición crece con log(tamaño) más el número de rectángulos del
+kernel. Al final se sugiere, por forma, el menor tamaño a partir del cual la
+descomposición gana siempre: es el valor que corresponde en
+Morfologia.TAMANO_MINIMO_DESCOMPOSICION.
+"""
+
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from clases import Morfologia
+
+
+TAMANOS = (5, 9, 15, 21, 31, 41, 61, 101, 151, 201, 301, 401, 601)
+FORMAS = ('cuadrado', 'elipse', 'cruz')
+
+
+def medir(funcion, repeticiones=3):
+    """Mejor tiempo (en segundos) de varias ejecuciones"""
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def erosion_descompuesta(imagen, kernel_size, forma):
+    """Erosión de Morfologia.aplicar con la descomposición activada para cualquier tamaño"""
+    umbrales = dict(Morfologia.TAMANO_MINIMO_DESCOMPOSICION)
+    Morfologia.TAMANO_MINIMO_DESCOMPOSICION.update({clave: 1 for clave in umbrales})
+    try:
+        return Morfologia.aplicar(imagen, kernel_size, 'erosion', forma)
+    finally:
+        Morfologia.TAMANO_MINIMO_DESCOMPOSICION.update(umbrales)
+
+
+def umbral_sugerido(resultados, forma):
+    """Menor tamaño desde el cual la descomposición es más rápida en todos los tamaños medidos"""
+    sugerido = None
+    for resultado in sorted((r for r in resultados if r['forma'] == forma),
+                            key=lambda r: r['kernel_size'], reverse=True):
+        if resultado['tiempo_descomposicion'] >= resultado['tiempo_opencv']:
+            break
+        sugerido = resultado['kernel_size']
+    return sugerido
+
+
+def ejecutar(lado=2048):
+    rng = np.random.default_rng(0)
+    imagen = ((rng.random((lado, lado)) > 0.5) * 255).astype(np.uint8)
+    resultados = []
+
+    print(f"Imagen de prueba: {lado}x{lado} uint8")
+    print(f"{'forma':<10}{'kernel':>8}{'rect.':>7}{'OpenCV (s)':>13}{'descomp. (s)':>15}{'iguales':>9}")
+    for forma in FORMAS:
+        for kernel_size in TAMANOS:
+            rectangulos = Morfologia.rectangulos(kernel_size, forma)
+            kernel = Morfologia.kernel(kernel_size, forma)
+
+            tiempo_cv2 = medir(lambda: cv2.erode(imagen, kernel))
+            tiempo_descomposicion = medir(lambda: erosion_descompuesta(imagen, kernel_size, forma))
+            iguales = np.array_equal(cv2.erode(imagen, kernel),
+                                     erosion_descompuesta(imagen, kernel_size, forma))
+
+            print(f"{forma:<10}{kernel_size:>8}{len(rectangulos):>7}"
+                  f"{tiempo_cv2:>13.4f}{tiempo_descomposicion:>15.4f}{'sí' if iguales else 'NO':>9}")
+            resultados.append({
+                'forma': forma,
+                'kernel_size': kernel_size,
+                'rectangulos': len(rectangulos),
+                'tiempo_opencv': tiempo_cv2,
+                'tiempo_descomposicion': tiempo_descomposicion,
+                'iguales': bool(iguales)
+            })
+
+    print("\nTamaño mínimo sugerido para la descomposición "
+          "(actual entre paréntesis; '-' si OpenCV gana en el mayor tamaño medido):")
+    for forma in FORMAS:
+        sugerido = umbral_sugerido(resultados, forma)
+        print(f"  {forma:<10}{sugerido if sugerido is not None else '-':>6}"
+              f"  ({Morfologia.TAMANO_MINIMO_DESCOMPOSICION[forma]})")
+    return resultados
+
+
+if __name__ == "__main__":
+    lado = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    resultados = ejecutar(lado)
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w', encoding='utf-8') as archivo:
+            json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en: {sys.argv[2]}")
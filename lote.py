@@ -0,0 +1,412 @@
+"""Modo por lotes (sin interfaz) para procesar bancos completos de imágenes
+
+Uso:
+    python main.py --lote trabajo.json
+    python lote.py trabajo.json
+
+El archivo de trabajo es un JSON con las siguientes claves (todas opcionales):
+    carpetas_dicom      Carpetas raíz; cada subcarpeta con archivos .dcm es un elemento
+    carpetas_imagenes   Carpetas con imágenes JPG/PNG
+    tipo_binarizacion   Clave de ProcesadorImagenes.TIPOS_BINARIZACION ("1" a "5")
+    umbral              Umbral de binarización (0-255), "otsu" o "triangulo" para
+                        calcularlo sobre el histograma de cada imagen
+    kernel_size         Tamaño del kernel de morfología
+    forma               "circulo" o "cuadrado"
+    traslaciones        Lista de pares [tx, ty] aplicados al corte central
+    ventana             Ventana de visualización de los PNG DICOM: "dicom" (la de la
+                        cabecera), "completo", un preset de Ventaneo.PRESETS
+                        ("cerebro", "hueso", "pulmon") o [centro, ancho]
+    montaje             true para escribir además una hoja de contactos con todos los
+                        cortes de cada serie (RenderizadorPNG.montaje)
+    directorio_salida   Carpeta de resultados (por defecto Resultados_Parcial3_<fecha>)
+    max_trabajadores    Número de procesos del pool (por defecto, uno por núcleo)
+    instrumentar        true para registrar tiempo, CPU, bytes leídos y cortes por etapa;
+                        "memoria" para medir además el pico de tracemalloc. Cada
+                        reporte recibe una sección de rendimiento y el detalle se
+                        guarda en Reportes/rendimiento_lote.json
+    modo_imagen         "color" (por defecto) o "gris" para decodificar las imágenes
+                        directamente en escala de grises (la binarización no usa el
+                        color; la imagen original y la figura se guardan en gris)
+    tamano_mosaico      Si se indica, las imágenes se procesan por mosaicos de este
+                        lado (ProcesadorImagenes.procesar_en_mosaicos) y no se genera
+                        la figura de cuatro paneles, que necesita la imagen completa
+
+Se ejecutan las opciones a), d) y e) del menú sobre cada elemento en un pool de
+procesos y los resultados se guardan con la misma estructura de carpetas que
+Resultados_Parcial3_*. Los archivos se nombran con la carpeta o el nombre de la imagen;
+si dos elementos coinciden (subcarpetas homónimas en distintas raíces) se agrega un
+sufijo con el hash de su ruta para que no se sobrescriban. Nunca se abre una ventana: las figuras se escriben como PNG con
+RenderizadorPNG, sin pasar por matplotlib.
+"""
+import matplotlib
+matplotlib.use('Agg')
+
+import hashlib
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+
+from clases import ProcesadorDICOM, ProcesadorImagenes, Instrumentacion, Ventaneo, RenderizadorPNG
+
+# Valores por defecto de la especificación del trabajo
+ESPECIFICACION_POR_DEFECTO = {
+    'carpetas_dicom': ['Banco Dicom'],
+    'carpetas_imagenes': ['Banco JPG o PNG'],
+    'tipo_binarizacion': '1',
+    'umbral': 127,
+    'kernel_size': 5,
+    'forma': 'circulo',
+    'traslaciones': [[50, 30], [-30, 50], [0, 70], [100, -50]],
+    'ventana': 'dicom',
+    'montaje': False,
+    'directorio_salida': None,
+    'max_trabajadores': None,
+    'instrumentar': False,
+    'modo_imagen': 'color',
+    'tamano_mosaico': None
+}
+
+EXTENSIONES_IMAGEN = ProcesadorImagenes.EXTENSIONES
+
+SUBCARPETAS_RESULTADOS = ('DICOM_procesados', 'Imagenes_procesadas', 'Pacientes',
+                          'Reportes', 'Transformaciones')
+
+UMBRALES_AUTOMATICOS = ('otsu', 'triangulo')
+
+
+def cargar_especificacion(ruta_especificacion):
+    """Lee el JSON del trabajo y completa los valores que falten"""
+    with open(ruta_especificacion, encoding='utf-8') as f:
+        especificacion = json.load(f)
+
+    desconocidas = set(especificacion) - set(ESPECIFICACION_POR_DEFECTO)
+    if desconocidas:
+        raise ValueError(f"Claves desconocidas en la especificación: {sorted(desconocidas)}")
+
+    completa = dict(ESPECIFICACION_POR_DEFECTO)
+    completa.update(especificacion)
+    completa['tipo_binarizacion'] = str(completa['tipo_binarizacion'])
+    if completa['tipo_binarizacion'] not in ProcesadorImagenes.TIPOS_BINARIZACION:
+        raise ValueError(f"Tipo de binarización no válido: {completa['tipo_binarizacion']}")
+    if completa['forma'] not in ('circulo', 'cuadrado'):
+        raise ValueError(f"Forma no válida: {completa['forma']}")
+    if completa['modo_imagen'] not in ('color', 'gris'):
+        raise ValueError(f"Modo de imagen no válido: {completa['modo_imagen']}")
+    umbral = completa['umbral']
+    if isinstance(umbral, str):
+        if umbral not in UMBRALES_AUTOMATICOS:
+            raise ValueError(f"Umbral no válido: {umbral} (use 0-255, 'otsu' o 'triangulo')")
+    elif isinstance(umbral, bool) or not isinstance(umbral, (int, float)) or not 0 <= umbral <= 255:
+        raise ValueError(f"Umbral no válido: {umbral} (use 0-255, 'otsu' o 'triangulo')")
+    return completa
+
+
+def buscar_carpetas_dicom(carpetas_raiz):
+    """Devuelve todas las carpetas (recursivamente) que contienen archivos .dcm"""
+    carpetas = []
+    for raiz in carpetas_raiz:
+        for ruta, _, archivos in os.walk(raiz):
+            if any(archivo.lower().endswith('.dcm') for archivo in archivos):
+                carpetas.append(ruta)
+    return sorted(carpetas)
+
+
+def buscar_imagenes(carpetas_raiz):
+    """Devuelve las imágenes JPG/PNG de las carpetas indicadas"""
+    imagenes = []
+    for raiz in carpetas_raiz:
+        for archivo in sorted(os.listdir(raiz)):
+            if archivo.lower().endswith(EXTENSIONES_IMAGEN):
+                imagenes.append(os.path.join(raiz, archivo))
+    return imagenes
+
+
+def clave_dicom(ruta_carpeta):
+    """Nombre base de los resultados de una carpeta DICOM"""
+    return os.path.basename(os.path.normpath(ruta_carpeta))
+
+
+def clave_imagen(ruta_imagen):
+    """Nombre base de los resultados de una imagen"""
+    return os.path.splitext(os.path.basename(ruta_imagen))[0]
+
+
+def asignar_claves(rutas, clave_base):
+    """Devuelve {ruta: clave} sin repetidos
+
+    Los elementos cuyo nombre coincide con el de otro (p. ej. "T2" en dos raíces, o
+    "a.jpg" y "a.png") reciben un sufijo con los primeros 8 dígitos del hash de su
+    ruta absoluta; los demás conservan el nombre de siempre.
+    """
+    claves = {ruta: clave_base(ruta) for ruta in rutas}
+    conteo = {}
+    for clave in claves.values():
+        conteo[clave] = conteo.get(clave, 0) + 1
+    for ruta, clave in claves.items():
+        if conteo[clave] > 1:
+            sufijo = hashlib.sha1(os.path.abspath(ruta).encode('utf-8')).hexdigest()[:8]
+            claves[ruta] = f"{clave}_{sufijo}"
+    return claves
+
+
+def escribir_reporte(directorio_reportes, tipo, clave, lineas):
+    """Escribe un reporte de texto con el mismo formato que los reportes del menú"""
+    ahora = datetime.now()
+    nombre_archivo = f"reporte_{tipo}_{clave}_{ahora.strftime('%Y%m%d_%H%M%S')}.txt"
+    ruta = os.path.join(directorio_reportes, nombre_archivo)
+    with open(ruta, 'w', encoding='utf-8') as f:
+        f.write(f"REPORTE DE PROCESAMIENTO - {tipo}\n")
+        f.write("=" * 60 + "\n")
+        f.write(f"Fecha y hora: {ahora.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        f.write("\n".join(lineas))
+    return ruta
+
+
+def agregar_seccion_reporte(ruta_reporte, lineas):
+    """Agrega una sección al final de un reporte ya escrito"""
+    with open(ruta_reporte, 'a', encoding='utf-8') as f:
+        f.write("\n\n" + "\n".join(lineas))
+
+
+@Instrumentacion.instrumentar
+def procesar_dicom(ruta_carpeta, especificacion, directorio_salida, clave=None):
+    """Opciones a) y d) sobre una carpeta DICOM; devuelve la lista de archivos generados"""
+    clave = clave or clave_dicom(ruta_carpeta)
+    generados = []
+
+    # Opción a): reconstrucción 3D de la serie principal
+    series = ProcesadorDICOM.escanear_cabeceras(ruta_carpeta)
+    if not series:
+        raise ValueError("No se encontraron archivos DICOM")
+    volumen_3d, archivos_dicom, nombres_archivos = ProcesadorDICOM.ensamblar_volumen(series[0])
+    if volumen_3d is None:
+        raise ValueError("Error en la reconstrucción 3D")
+
+    ventana = especificacion['ventana']
+    if isinstance(ventana, list):
+        ventana = tuple(ventana)
+    ruta_figura = os.path.join(directorio_salida, 'DICOM_procesados', f"reconstruccion_3D_{clave}.png")
+    ProcesadorDICOM.mostrar_cortes(volumen_3d, "Reconstrucción 3D - Archivos DICOM", ruta_figura,
+                                   ventana, archivos_dicom)
+    generados.append(ruta_figura)
+    if especificacion['montaje']:
+        ruta_montaje = os.path.join(directorio_salida, 'DICOM_procesados', f"montaje_{clave}.png")
+        # Un solo hilo: el lote ya reparte los elementos entre procesos
+        RenderizadorPNG.montaje(volumen_3d, ruta_montaje, ventana=ventana, archivos_dicom=archivos_dicom,
+                                titulo=f"{clave} - {len(archivos_dicom)} cortes", paralelo=False)
+        generados.append(ruta_montaje)
+
+    generados.append(escribir_reporte(os.path.join(directorio_salida, 'Reportes'), 'DICOM', clave, [
+        f"Clave: {clave}",
+        f"Número de archivos DICOM: {len(archivos_dicom)}",
+        f"Dimensiones del volumen 3D: {volumen_3d.shape}",
+        f"Ruta original: {os.path.abspath(ruta_carpeta)}",
+        f"Archivos procesados: {', '.join(nombres_archivos[:5])}..."
+    ]))
+
+    # Opción d): traslaciones del corte central
+    indice_central = volumen_3d.shape[0]//2
+    imagen_original = volumen_3d[indice_central, :, :]
+    parametros = Ventaneo.parametros_cabecera(archivos_dicom[indice_central])
+    # Misma ventana para la original y todas las trasladadas
+    ventana_fija = Ventaneo.resolver_ventana(imagen_original, ventana, parametros)
+    original_8bits = Ventaneo.a_uint8(imagen_original, ventana_fija, parametros)
+    for tx, ty in especificacion['traslaciones']:
+        imagen_trasladada = ProcesadorDICOM.trasladar_imagen(imagen_original, tx, ty)
+        trasladada_8bits = Ventaneo.a_uint8(imagen_trasladada, ventana_fija, parametros)
+
+        nombre_comparacion = f"transformacion_{clave}_X{tx}_Y{ty}.png"
+        nombre_trasladada = f"imagen_trasladada_{clave}_X{tx}_Y{ty}.png"
+        ruta_comparacion = os.path.join(directorio_salida, 'Transformaciones', nombre_comparacion)
+        ruta_trasladada = os.path.join(directorio_salida, 'Transformaciones', nombre_trasladada)
+        ProcesadorDICOM.mostrar_traslacion(original_8bits, trasladada_8bits, tx, ty, ruta_comparacion)
+        cv2.imwrite(ruta_trasladada, trasladada_8bits)
+        generados.extend([ruta_comparacion, ruta_trasladada])
+
+        generados.append(escribir_reporte(
+            os.path.join(directorio_salida, 'Reportes'), 'TRANSFORMACION_GEOMETRICA',
+            f"{clave}_X{tx}_Y{ty}", [
+                f"Clave DICOM: {clave}",
+                "Transformación aplicada: Traslación",
+                f"Desplazamiento X: {tx}",
+                f"Desplazamiento Y: {ty}",
+                f"Dimensiones imagen original: {imagen_original.shape}",
+                f"Ventana de visualización: {ventana}",
+                f"Archivo de comparación: {nombre_comparacion}",
+                f"Archivo imagen trasladada: {nombre_trasladada}"
+            ]))
+
+    return generados
+
+
+@Instrumentacion.instrumentar
+def procesar_imagen(ruta_imagen, especificacion, directorio_salida, clave=None):
+    """Opción e) sobre una imagen JPG/PNG; devuelve la lista de archivos generados"""
+    clave = clave or clave_imagen(ruta_imagen)
+    tipo_binarizacion = especificacion['tipo_binarizacion']
+    umbral = especificacion['umbral']
+    kernel_size = especificacion['kernel_size']
+    forma = especificacion['forma']
+
+    if especificacion.get('tamano_mosaico'):
+        return procesar_imagen_en_mosaicos(ruta_imagen, especificacion, directorio_salida, clave)
+
+    imagen_original = ProcesadorImagenes.cargar_imagen(ruta_imagen, especificacion['modo_imagen'])
+    if imagen_original is None:
+        raise ValueError("No se pudo cargar la imagen")
+
+    if umbral in UMBRALES_AUTOMATICOS:
+        histograma = ProcesadorImagenes.calcular_histograma(imagen_original)
+        umbral = ProcesadorImagenes.umbral_automatico(histograma, umbral)
+
+    imagen_binarizada = ProcesadorImagenes.binarizar_imagen(imagen_original, tipo_binarizacion, umbral)
+    imagen_morfologica = ProcesadorImagenes.aplicar_morfologia(imagen_binarizada, kernel_size)
+    tipo_bin_nombre = ProcesadorImagenes.TIPOS_BINARIZACION[tipo_binarizacion][0]
+    imagen_final = ProcesadorImagenes.dibujar_forma_con_texto(
+        imagen_morfologica, forma, f"Imagen binarizada ({tipo_bin_nombre})", umbral, kernel_size
+    )
+
+    carpeta_imagenes = os.path.join(directorio_salida, 'Imagenes_procesadas')
+    ruta_original = os.path.join(carpeta_imagenes, f"imagen_original_{clave}.png")
+    ruta_figura = os.path.join(carpeta_imagenes, f"procesamiento_{clave}_{tipo_bin_nombre}_{forma}.png")
+    ruta_final = os.path.join(carpeta_imagenes, f"imagen_procesada_{clave}_{tipo_bin_nombre}_{forma}.png")
+    cv2.imwrite(ruta_original, imagen_original)
+    ProcesadorImagenes.mostrar_procesamiento(
+        imagen_original, imagen_binarizada, imagen_morfologica, imagen_final,
+        tipo_bin_nombre, kernel_size, forma, ruta_figura
+    )
+    cv2.imwrite(ruta_final, imagen_final)
+
+    ruta_reporte = escribir_reporte(os.path.join(directorio_salida, 'Reportes'), 'IMAGEN', clave, [
+        f"Clave: {clave}",
+        f"Ruta original: {os.path.abspath(ruta_imagen)}",
+        f"Dimensiones de la imagen: {imagen_original.shape}",
+        f"Tipo de binarización: {tipo_bin_nombre}",
+        f"Umbral: {umbral}",
+        f"Kernel morfología: {kernel_size}x{kernel_size}",
+        f"Forma dibujada: {forma}",
+        f"Archivo imagen procesada: {os.path.basename(ruta_final)}"
+    ])
+    return [ruta_original, ruta_figura, ruta_final, ruta_reporte]
+
+
+def procesar_imagen_en_mosaicos(ruta_imagen, especificacion, directorio_salida, clave=None):
+    """Opción e) por mosaicos para imágenes que no caben en memoria"""
+    clave = clave or clave_imagen(ruta_imagen)
+    tipo_binarizacion = especificacion['tipo_binarizacion']
+    kernel_size = especificacion['kernel_size']
+    forma = especificacion['forma']
+    tipo_bin_nombre = ProcesadorImagenes.TIPOS_BINARIZACION[tipo_binarizacion][0]
+
+    carpeta_imagenes = os.path.join(directorio_salida, 'Imagenes_procesadas')
+    ruta_final = os.path.join(carpeta_imagenes, f"imagen_procesada_{clave}_{tipo_bin_nombre}_{forma}.png")
+    resultado, umbral = ProcesadorImagenes.procesar_en_mosaicos(
+        ruta_imagen, ruta_final, tipo_binarizacion, especificacion['umbral'], kernel_size, forma,
+        tamano_mosaico=especificacion['tamano_mosaico']
+    )
+    if resultado is None:
+        raise ValueError("No se pudo cargar la imagen")
+
+    ruta_reporte = escribir_reporte(os.path.join(directorio_salida, 'Reportes'), 'IMAGEN', clave, [
+        f"Clave: {clave}",
+        f"Ruta original: {os.path.abspath(ruta_imagen)}",
+        f"Tipo de binarización: {tipo_bin_nombre}",
+        f"Umbral: {umbral}",
+        f"Kernel morfología: {kernel_size}x{kernel_size}",
+        f"Forma dibujada: {forma}",
+        f"Procesada por mosaicos de {especificacion['tamano_mosaico']} pixeles",
+        f"Archivo imagen procesada: {os.path.basename(ruta_final)}"
+    ])
+    return [ruta_final, ruta_reporte]
+
+
+def _ejecutar_tarea(tarea):
+    """Ejecuta una tarea del pool y captura el error para que no detenga el lote"""
+    tipo, ruta, clave, especificacion, directorio_salida = tarea
+    if especificacion['instrumentar']:
+        Instrumentacion.activar(memoria=especificacion['instrumentar'] == 'memoria')
+    try:
+        if tipo == 'dicom':
+            generados = procesar_dicom(ruta, especificacion, directorio_salida, clave)
+        else:
+            generados = procesar_imagen(ruta, especificacion, directorio_salida, clave)
+        resultado = {'tipo': tipo, 'ruta': ruta, 'generados': generados, 'error': None}
+    except Exception as e:
+        resultado = {'tipo': tipo, 'ruta': ruta, 'generados': [],
+                     'error': f"{e}\n{traceback.format_exc()}"}
+
+    resultado['rendimiento'] = []
+    if especificacion['instrumentar']:
+        resultado['rendimiento'] = Instrumentacion.registros()
+        Instrumentacion.desactivar()
+        lineas = Instrumentacion.lineas_resumen(resultado['rendimiento'])
+        for ruta_generada in resultado['generados']:
+            if os.path.basename(ruta_generada).startswith('reporte_'):
+                agregar_seccion_reporte(ruta_generada, lineas)
+    return resultado
+
+
+def ejecutar_lote(ruta_especificacion, instrumentar=None):
+    """Procesa todos los elementos de la especificación y devuelve los resultados por tarea
+
+    `instrumentar` (True o "memoria") tiene prioridad sobre la clave de la especificación.
+    """
+    especificacion = cargar_especificacion(ruta_especificacion)
+    if instrumentar is not None:
+        especificacion['instrumentar'] = instrumentar
+
+    directorio_salida = especificacion['directorio_salida']
+    if directorio_salida is None:
+        directorio_salida = f"Resultados_Parcial3_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    for subcarpeta in SUBCARPETAS_RESULTADOS:
+        os.makedirs(os.path.join(directorio_salida, subcarpeta), exist_ok=True)
+
+    claves_dicom = asignar_claves(buscar_carpetas_dicom(especificacion['carpetas_dicom']), clave_dicom)
+    claves_imagenes = asignar_claves(buscar_imagenes(especificacion['carpetas_imagenes']), clave_imagen)
+    tareas = [('dicom', ruta, clave, especificacion, directorio_salida)
+              for ruta, clave in claves_dicom.items()]
+    tareas += [('imagen', ruta, clave, especificacion, directorio_salida)
+               for ruta, clave in claves_imagenes.items()]
+    print(f"Procesando {len(tareas)} elementos en {directorio_salida}")
+
+    resultados = []
+    with ProcessPoolExecutor(max_workers=especificacion['max_trabajadores']) as ejecutor:
+        for resultado in ejecutor.map(_ejecutar_tarea, tareas):
+            estado = "OK" if resultado['error'] is None else "ERROR"
+            print(f"[{estado}] {resultado['tipo']}: {resultado['ruta']}")
+            resultados.append(resultado)
+
+    errores = [r for r in resultados if r['error'] is not None]
+    ruta_resumen = escribir_reporte(os.path.join(directorio_salida, 'Reportes'), 'LOTE', 'resumen', [
+        f"Especificación: {os.path.abspath(ruta_especificacion)}",
+        f"Elementos procesados: {len(resultados) - len(errores)} de {len(resultados)}",
+        f"Archivos generados: {sum(len(r['generados']) for r in resultados)}",
+        "Errores:" if errores else "Errores: ninguno"
+    ] + [f"  - {r['ruta']}: {r['error'].splitlines()[0]}" for r in errores])
+
+    if especificacion['instrumentar']:
+        registros = [registro for r in resultados for registro in r['rendimiento']]
+        agregar_seccion_reporte(ruta_resumen, Instrumentacion.lineas_resumen(registros))
+        ruta_rendimiento = os.path.join(directorio_salida, 'Reportes', 'rendimiento_lote.json')
+        with open(ruta_rendimiento, 'w', encoding='utf-8') as f:
+            json.dump({
+                'resumen': Instrumentacion.resumen(registros),
+                'tareas': [{'tipo': r['tipo'], 'ruta': r['ruta'], 'registros': r['rendimiento']}
+                           for r in resultados]
+            }, f, indent=2, ensure_ascii=False)
+        print(f"Tiempos por etapa guardados en: {ruta_rendimiento}")
+
+    print(f"Lote terminado: {len(resultados) - len(errores)} de {len(resultados)} elementos sin errores")
+    return resultados
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Uso: python lote.py <especificacion.json>")
+        sys.exit(1)
+    ejecutar_lote(sys.argv[1])
@@ -1,16 +1,108 @@
-from clases import Paciente, ProcesadorDICOM, ProcesadorImagenes
+from clases import (Paciente, ProcesadorDICOM, ProcesadorImagenes, CacheVolumenes, Instrumentacion,
+                    AlmacenPacientes, CacheMemoria, ColeccionEnCache, GestorTrabajos, Ventaneo,
+                    Proyecciones, Segmentacion3D, CatalogoDICOM)
 import cv2
 import os
-import numpy as np
+import sys
+import select
+from datetime import datetime
 from matplotlib import pyplot as plt
 
-# Diccionarios globales (fuera de clases como se solicita)
-diccionario_dicom = {}
-diccionario_pacientes = {}
-diccionario_imagenes = {}
+# Volúmenes e imágenes ya leídos se conservan en RAM hasta este límite; lo que
+# se usó hace más tiempo pasa a archivos temporales
+LIMITE_MEMORIA_BYTES = 1024 ** 3
+
+# Globales del menú. Se crean en inicializar() al arrancar main(), así importar
+# este módulo no crea archivos ni abre bases de datos
+almacen = None
+cache_memoria = None
+diccionario_dicom = None
+diccionario_pacientes = None
+diccionario_imagenes = None
+cache_volumenes = None
+catalogo = None
+gestor_trabajos = None
+cargas_pendientes = {}
+# Número de trabajo -> función que recibe su resultado y sigue el diálogo en el menú
+continuaciones = {}
+# Carpeta Resultados_Parcial3_<fecha> de la sesión; se crea la primera vez que se usa
+directorio_resultados = None
+
+def inicializar():
+    """Crea el almacén, las cachés, el catálogo y el gestor de trabajos del menú"""
+    global almacen, cache_memoria, diccionario_dicom, diccionario_pacientes, diccionario_imagenes
+    global cache_volumenes, catalogo, gestor_trabajos
+    
+    # Almacén persistente: los datos sobreviven entre sesiones y los volúmenes se
+    # leen de disco solo cuando se usan
+    almacen = AlmacenPacientes()
+    cache_memoria = CacheMemoria(LIMITE_MEMORIA_BYTES)
+    
+    # Diccionarios globales (fuera de clases como se solicita), respaldados por el almacén
+    diccionario_dicom = ColeccionEnCache(almacen.dicom, cache_memoria, 'dicom')
+    diccionario_pacientes = ColeccionEnCache(almacen.pacientes, cache_memoria, 'pacientes')
+    diccionario_imagenes = ColeccionEnCache(almacen.imagenes, cache_memoria, 'imagenes')
+    
+    # Caché en disco de volúmenes ya reconstruidos
+    cache_volumenes = CacheVolumenes()
+    
+    # Catálogo de cabeceras del banco DICOM para buscar series sin abrir carpetas
+    catalogo = CatalogoDICOM()
+    
+    # Las reconstrucciones DICOM corren en segundo plano para que el menú siga
+    # respondiendo; cargas_pendientes relaciona cada clave con su trabajo
+    gestor_trabajos = GestorTrabajos()
+
+def finalizar():
+    """Cancela los trabajos pendientes y cierra las cachés y las bases de datos"""
+    if gestor_trabajos.pendientes():
+        print("Cancelando los trabajos en segundo plano...")
+    gestor_trabajos.cerrar()
+    estadisticas = cache_memoria.estadisticas()
+    print(f"Caché en memoria: {estadisticas['aciertos']} aciertos, {estadisticas['fallos']} fallos, "
+          f"{estadisticas['desalojos']} desalojos, {estadisticas['recuperaciones']} recuperaciones")
+    cache_memoria.cerrar()
+    catalogo.cerrar()
+    almacen.cerrar()
+
+def carpeta_resultados(subcarpeta):
+    """Subcarpeta de los resultados de la sesión (misma estructura que el modo por lotes)"""
+    global directorio_resultados
+    if directorio_resultados is None:
+        directorio_resultados = f"Resultados_Parcial3_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    ruta = os.path.join(directorio_resultados, subcarpeta)
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
 
 # Funciones para el menú principal y opciones
 
+def leer(mensaje=""):
+    """input() que sigue atendiendo las ventanas de matplotlib mientras espera
+    
+    Con figuras abiertas y la entrada en una terminal POSIX, la línea se espera
+    con select y entre tanto se procesan los eventos de las figuras, así se
+    pueden mover, redimensionar y ampliar. En otro caso es input().
+    """
+    if os.name != 'posix' or not plt.get_fignums() or not sys.stdin.isatty():
+        return input(mensaje)
+    print(mensaje, end='', flush=True)
+    while True:
+        for numero in plt.get_fignums():
+            plt.figure(numero).canvas.flush_events()
+        listos, _, _ = select.select([sys.stdin], [], [], 0.05)
+        if listos:
+            linea = sys.stdin.readline()
+            if not linea:
+                raise EOFError
+            return linea.rstrip('\n')
+
+def en_segundo_plano(descripcion, funcion, continuacion, *args):
+    """Envía funcion(trabajo, *args) al gestor; al terminar, continuacion(resultado) sigue en el menú"""
+    trabajo = gestor_trabajos.enviar(descripcion, funcion, *args)
+    continuaciones[trabajo.numero] = continuacion
+    print(f"{descripcion} iniciada en segundo plano (opción 'g' para ver el progreso).")
+    return trabajo
+
 def mostrar_menu_principal():
     """Muestra el menú principal"""
     print("\n" + "="*50)
@@ -21,55 +113,218 @@ def mostrar_menu_principal():
     print("c) Ingresar imágenes JPG/PNG")
     print("d) Transformación geométrica (traslación)")
     print("e) Procesamiento de imágenes JPG/PNG")
+    print("g) Trabajos en segundo plano")
+    print("h) Proyecciones (MIP/MinIP/AvgIP) y planos oblicuos")
+    print("i) Segmentación 3D (umbral y componentes conexas)")
+    print("j) Catálogo del banco DICOM (buscar y cargar series)")
     print("f) Salir")
     print("="*50)
 
+def clave_en_carga(clave):
+    """Avisa si la clave DICOM todavía se está reconstruyendo en segundo plano"""
+    trabajo = cargas_pendientes.get(clave)
+    if trabajo is not None and not trabajo.terminado:
+        print(f"La clave '{clave}' todavía se está cargando ({trabajo.hechos}/{trabajo.total} cortes).")
+        return True
+    return False
+
+# Es la etapa de la opción a (y de las cargas de la j): el manejador del menú solo
+# pide los datos y envía el trabajo, así que su tiempo no diría nada de la carga
+@Instrumentacion.instrumentar
+def reconstruir_en_segundo_plano(trabajo, serie, ruta_carpeta, resumen_series, clave):
+    """Reconstruye la serie, la guarda en caché y en el diccionario DICOM"""
+    volumen_3d, archivos_dicom, nombres_archivos = ProcesadorDICOM.ensamblar_volumen(
+        serie, paralelo=True, progreso=trabajo.progreso)
+    if volumen_3d is None or not archivos_dicom:
+        raise ValueError("no se pudo reconstruir el volumen 3D")
+    
+    cache_volumenes.guardar(ruta_carpeta, resumen_series, serie['serie_uid'], volumen_3d,
+                            archivos_dicom, nombres_archivos)
+    # Se guarda el memmap de la caché: el almacén lo copia una sola vez y en las
+    # siguientes cargas lo reconoce por el archivo, sin volver a leerlo
+    en_cache = cache_volumenes.obtener(ruta_carpeta, serie['serie_uid'])
+    if en_cache is not None:
+        volumen_3d = en_cache[0]
+    
+    diccionario_dicom[clave] = {
+        'archivos_dicom': archivos_dicom,
+        'volumen_3d': volumen_3d,
+        'nombres_archivos': nombres_archivos,
+        'ruta_carpeta': ruta_carpeta
+    }
+    return volumen_3d
+
+def escanear_en_segundo_plano(trabajo, ruta_carpeta):
+    """Lee las cabeceras de la carpeta informando el avance al trabajo"""
+    return ProcesadorDICOM.escanear_cabeceras(ruta_carpeta, paralelo=True, progreso=trabajo.progreso)
+
+def avisar_trabajos_terminados():
+    """Informa los trabajos que terminaron, sigue sus diálogos y muestra los volúmenes reconstruidos"""
+    for trabajo in gestor_trabajos.terminados_sin_avisar():
+        continuacion = continuaciones.pop(trabajo.numero, None)
+        if trabajo.estado == 'terminado' and continuacion is not None:
+            print(f"\n{trabajo.descripcion}: listo.")
+            continuacion(trabajo.resultado)
+        elif trabajo.estado == 'terminado':
+            volumen_3d = trabajo.resultado
+            print(f"\n{trabajo.descripcion}: listo. Volumen 3D con dimensiones: {volumen_3d.shape}")
+            ProcesadorDICOM.mostrar_cortes(volumen_3d, "Reconstrucción 3D - Archivos DICOM")
+        elif trabajo.estado == 'cancelado':
+            print(f"\n{trabajo.descripcion}: cancelado.")
+        else:
+            print(f"\n{trabajo.descripcion}: error ({trabajo.error}).")
+
+def opcion_g_trabajos():
+    """Opción g: Ver el progreso de los trabajos en segundo plano y cancelarlos"""
+    print("\n=== TRABAJOS EN SEGUNDO PLANO ===")
+    
+    trabajos = gestor_trabajos.trabajos()
+    if not trabajos:
+        print("No hay trabajos.")
+        return
+    for trabajo in trabajos:
+        print(f"  {trabajo}")
+    
+    if not gestor_trabajos.pendientes():
+        return
+    numero = leer("Número del trabajo a cancelar (Enter para volver): ")
+    if not numero:
+        return
+    trabajo = gestor_trabajos.obtener(int(numero)) if numero.isdigit() else None
+    if trabajo is None or trabajo.terminado:
+        print("Ese trabajo no está pendiente.")
+        return
+    trabajo.cancelar()
+    print(f"Cancelación solicitada para el trabajo {trabajo.numero}.")
+
 def opcion_a_procesar_dicom():
     """Opción a: Procesamiento de archivos DICOM"""
     print("\n=== PROCESAMIENTO DE ARCHIVOS DICOM ===")
     
-    ruta_carpeta = input("Ingrese la ruta de la carpeta con archivos DICOM: ")
+    ruta_carpeta = leer("Ingrese la ruta de la carpeta con archivos DICOM: ")
     
     if not os.path.exists(ruta_carpeta):
         print("Error: La ruta especificada no existe.")
         return
     
-    # Cargar archivos DICOM
-    archivos_dicom, nombres_archivos = ProcesadorDICOM.cargar_carpeta_dicom(ruta_carpeta)
+    # Si la carpeta no cambió desde la última vez, el resumen de series está en caché;
+    # si no, las cabeceras se leen en segundo plano y la selección sigue al terminar
+    resumen_series = cache_volumenes.series_en_cache(ruta_carpeta)
+    if resumen_series is None:
+        en_segundo_plano(f"Lectura de cabeceras de '{ruta_carpeta}'", escanear_en_segundo_plano,
+                         lambda series: seleccionar_serie(ruta_carpeta, series), ruta_carpeta)
+        return
+    seleccionar_serie(ruta_carpeta, None, resumen_series)
+
+def seleccionar_serie(ruta_carpeta, series, resumen_series=None):
+    """Pide la serie a cargar entre las de la carpeta y la abre o empieza a reconstruirla
+    
+    `series` son las series ya leídas (o None si solo se tiene el resumen en caché).
+    """
+    if resumen_series is None:
+        resumen_series = ProcesadorDICOM.resumir_series(series)
+    if not resumen_series:
+        print("No se encontraron archivos DICOM en la carpeta especificada.")
+        return
+    
+    indice_serie = 0
+    if len(resumen_series) > 1:
+        print("La carpeta contiene varias series:")
+        for i, s in enumerate(resumen_series, 1):
+            print(f"{i}. {s['descripcion']} ({s['num_cortes']} cortes)")
+        seleccion = leer(f"Seleccione la serie a cargar (1-{len(resumen_series)}, recomendado 1): ") or "1"
+        if not seleccion.isdigit() or not 1 <= int(seleccion) <= len(resumen_series):
+            print("Opción no válida.")
+            return
+        indice_serie = int(seleccion) - 1
+    serie_uid = resumen_series[indice_serie]['serie_uid']
+    
+    serie = None
+    if series is not None:
+        serie = next((s for s in series if s['serie_uid'] == serie_uid), None)
+    
+    def obtener_serie(trabajo):
+        encontradas = escanear_en_segundo_plano(trabajo, ruta_carpeta)
+        return next((s for s in encontradas if s['serie_uid'] == serie_uid), None)
+    
+    cargar_serie_seleccionada(ruta_carpeta, resumen_series, serie_uid, serie, obtener_serie)
+
+def previsualizar_serie(serie):
+    """Muestra los cortes centrales de la serie sin esperar a decodificarla completa
+    
+    Solo con archivos sin compresión: el volumen perezoso los abre con mmap y lee
+    una fila y una columna de cada uno. Comprimidos habría que decodificarlos
+    todos, así que se espera a la carga en segundo plano.
+    """
+    volumen_3d, archivos_dicom, _ = ProcesadorDICOM.cargar_volumen_perezoso(serie)
+    if volumen_3d is None or not volumen_3d.nativo:
+        return
+    ProcesadorDICOM.mostrar_cortes(volumen_3d, f"Vista previa - {serie['descripcion']}")
+
+def iniciar_reconstruccion(ruta_carpeta, resumen_series, serie):
+    """Muestra la vista previa, pide la clave y decodifica la serie en segundo plano"""
+    if serie is None:
+        print("Error: La serie seleccionada ya no está en la carpeta.")
+        return
+    previsualizar_serie(serie)
+    
+    # La decodificación se hace en segundo plano; el resultado queda con esta clave
+    clave = leer("Ingrese una clave para guardar estos archivos DICOM: ")
+    if clave_en_carga(clave):
+        return
+    descripcion = f"Carga DICOM '{clave}' ({len(serie['rutas'])} cortes)"
+    cargas_pendientes[clave] = gestor_trabajos.enviar(
+        descripcion, reconstruir_en_segundo_plano, serie, ruta_carpeta, resumen_series, clave)
+    print(f"{descripcion} iniciada en segundo plano (opción 'g' para ver el progreso).")
+
+def cargar_serie_seleccionada(ruta_carpeta, resumen_series, serie_uid, serie=None, obtener_serie=None):
+    """Abre la serie desde la caché o lanza su reconstrucción en segundo plano
+    
+    `serie` es la serie con rutas y cabeceras si ya se leyó. Si falta y el
+    volumen no está en la caché, obtener_serie(trabajo) la busca en segundo
+    plano (lee cabeceras) y la carga sigue cuando termina.
+    """
+    en_cache = cache_volumenes.obtener(ruta_carpeta, serie_uid)
+    if en_cache is None:
+        if serie is None:
+            en_segundo_plano(f"Lectura de cabeceras de '{ruta_carpeta}'", obtener_serie,
+                             lambda serie: iniciar_reconstruccion(ruta_carpeta, resumen_series, serie))
+            return
+        iniciar_reconstruccion(ruta_carpeta, resumen_series, serie)
+        return
+    
+    volumen_3d, archivos_dicom, nombres_archivos = en_cache
+    print("Volumen cargado desde la caché")
     
     if not archivos_dicom:
         print("No se encontraron archivos DICOM en la carpeta especificada.")
         return
     
     print(f"Se cargaron {len(archivos_dicom)} archivos DICOM")
+    print(f"Volumen 3D reconstruido con dimensiones: {volumen_3d.shape}")
     
-    # Reconstruir volumen 3D
-    volumen_3d = ProcesadorDICOM.reconstruir_3d(archivos_dicom)
+    # Mostrar los 3 cortes
+    ProcesadorDICOM.mostrar_cortes(volumen_3d, "Reconstrucción 3D - Archivos DICOM")
     
-    if volumen_3d is not None:
-        print(f"Volumen 3D reconstruido con dimensiones: {volumen_3d.shape}")
-        
-        # Mostrar los 3 cortes
-        ProcesadorDICOM.mostrar_cortes(volumen_3d, "Reconstrucción 3D - Archivos DICOM")
-        
-        # Guardar en diccionario
-        clave = input("Ingrese una clave para guardar estos archivos DICOM: ")
-        diccionario_dicom[clave] = {
-            'archivos_dicom': archivos_dicom,
-            'volumen_3d': volumen_3d,
-            'nombres_archivos': nombres_archivos,
-            'ruta_carpeta': ruta_carpeta
-        }
-        
-        print(f"Archivos DICOM guardados con la clave: '{clave}'")
-    else:
-        print("Error en la reconstrucción 3D")
+    # Guardar en diccionario
+    clave = leer("Ingrese una clave para guardar estos archivos DICOM: ")
+    if clave_en_carga(clave):
+        return
+    diccionario_dicom[clave] = {
+        'archivos_dicom': archivos_dicom,
+        'volumen_3d': volumen_3d,
+        'nombres_archivos': nombres_archivos,
+        'ruta_carpeta': ruta_carpeta
+    }
+    
+    print(f"Archivos DICOM guardados con la clave: '{clave}'")
 
+@Instrumentacion.instrumentar
 def opcion_b_ingresar_paciente():
     """Opción b: Ingresar Paciente"""
     print("\n=== INGRESAR PACIENTE ===")
     
-    if not diccionario_dicom:
+    if not diccionario_dicom and not gestor_trabajos.pendientes():
         print("Error: No hay archivos DICOM procesados. Primero ejecute la opción 'a'.")
         return
     
@@ -77,9 +332,14 @@ def opcion_b_ingresar_paciente():
     print("Claves DICOM disponibles:")
     for clave in diccionario_dicom.keys():
         print(f"  - {clave}")
+    for clave, trabajo in cargas_pendientes.items():
+        if not trabajo.terminado:
+            print(f"  - {clave} (cargando {trabajo.hechos}/{trabajo.total})")
     
-    clave_dicom = input("Ingrese la clave del DICOM a usar para el paciente: ")
+    clave_dicom = leer("Ingrese la clave del DICOM a usar para el paciente: ")
     
+    if clave_en_carga(clave_dicom):
+        return
     if clave_dicom not in diccionario_dicom:
         print("Error: Clave no encontrada.")
         return
@@ -99,35 +359,41 @@ def opcion_b_ingresar_paciente():
     print(f"  ID: {id_paciente}")
     
     # Permitir modificar la información
-    modificar = input("¿Desea modificar esta información? (s/n): ").lower()
+    modificar = leer("¿Desea modificar esta información? (s/n): ").lower()
     if modificar == 's':
-        nombre = input(f"Nuevo nombre (actual: {nombre}): ") or nombre
-        edad = input(f"Nueva edad (actual: {edad}): ") or edad
-        id_paciente = input(f"Nuevo ID (actual: {id_paciente}): ") or id_paciente
+        nombre = leer(f"Nuevo nombre (actual: {nombre}): ") or nombre
+        edad = leer(f"Nueva edad (actual: {edad}): ") or edad
+        id_paciente = leer(f"Nuevo ID (actual: {id_paciente}): ") or id_paciente
     
     # Crear paciente
     paciente = Paciente(nombre, edad, id_paciente, volumen_3d)
     
     # Guardar en diccionario de pacientes
-    clave_paciente = input("Ingrese una clave para guardar el paciente: ")
+    clave_paciente = leer("Ingrese una clave para guardar el paciente: ")
     diccionario_pacientes[clave_paciente] = paciente
     
-    # También guardar el DICOM en el diccionario de imágenes
-    diccionario_imagenes[clave_dicom] = datos_dicom
+    # También registrar el DICOM en el diccionario de imágenes (solo la referencia,
+    # el volumen no se guarda dos veces)
+    diccionario_imagenes[clave_dicom] = {'tipo': 'dicom', 'clave_dicom': clave_dicom}
     
     print(f"Paciente creado y guardado con la clave: '{clave_paciente}'")
     print(f"DICOM asociado guardado en diccionario de imágenes")
 
+@Instrumentacion.instrumentar
 def opcion_c_ingresar_imagenes():
     """Opción c: Ingresar imágenes JPG/PNG"""
     print("\n=== INGRESAR IMÁGENES JPG/PNG ===")
     
-    ruta_imagen = input("Ingrese la ruta de la imagen (JPG/PNG): ")
+    ruta_imagen = leer("Ingrese la ruta de la imagen (JPG/PNG) o de una carpeta de imágenes: ")
     
     if not os.path.exists(ruta_imagen):
         print("Error: La imagen especificada no existe.")
         return
     
+    if os.path.isdir(ruta_imagen):
+        ingresar_carpeta_imagenes(ruta_imagen)
+        return
+    
     # Cargar imagen
     imagen = ProcesadorImagenes.cargar_imagen(ruta_imagen)
     
@@ -138,7 +404,7 @@ def opcion_c_ingresar_imagenes():
     print(f"Imagen cargada exitosamente. Dimensiones: {imagen.shape}")
     
     # Guardar en diccionario
-    clave = input("Ingrese una clave para guardar la imagen: ")
+    clave = leer("Ingrese una clave para guardar la imagen: ")
     diccionario_imagenes[clave] = {
         'imagen': imagen,
         'ruta': ruta_imagen,
@@ -147,11 +413,48 @@ def opcion_c_ingresar_imagenes():
     
     print(f"Imagen guardada con la clave: '{clave}'")
 
+def ingresar_carpeta_imagenes(ruta_carpeta):
+    """Carga todas las imágenes de una carpeta en paralelo y las guarda con claves automáticas"""
+    # La opción e) binariza: si no se necesita el color, se decodifica directo a gris
+    modo = 'gris' if leer("¿Cargar en escala de grises para binarizar? (s/n, recomendado s): ").lower() != 'n' \
+        else 'color'
+    reduccion = leer("Reducción de resolución para vista previa (1, 2, 4 u 8; recomendado 1): ") or "1"
+    if not reduccion.isdigit() or (modo, int(reduccion)) not in ProcesadorImagenes.BANDERAS_LECTURA:
+        print("Opción no válida.")
+        return
+    reduccion = int(reduccion)
+    # Las vistas previas no reemplazan a la imagen completa: llevan la reducción en la clave
+    sufijo = f"_r{reduccion}" if reduccion > 1 else ""
+    
+    imagenes = ProcesadorImagenes.cargar_carpeta(ruta_carpeta, modo, reduccion)
+    if not imagenes:
+        print("No se encontraron imágenes JPG/PNG en la carpeta especificada.")
+        return
+    
+    existentes = set(diccionario_imagenes.keys())
+    for ruta, imagen in imagenes:
+        clave = ProcesadorImagenes.clave_automatica(ruta, existentes, sufijo)
+        existentes.add(clave)
+        diccionario_imagenes[clave] = {
+            'imagen': imagen,
+            'ruta': ruta,
+            'tipo': 'imagen_comun',
+            'modo': modo,
+            'reduccion': reduccion
+        }
+        print(f"  - {clave}: {imagen.shape}")
+    
+    print(f"{len(imagenes)} imágenes guardadas con claves automáticas")
+    if reduccion > 1:
+        print(f"Son vistas previas a 1/{reduccion} de la resolución original; "
+              "cárguelas con reducción 1 para procesarlas completas.")
+
+@Instrumentacion.instrumentar
 def opcion_d_transformacion_geometrica():
     """Opción d: Transformación geométrica (traslación)"""
     print("\n=== TRANSFORMACIÓN GEOMÉTRICA (TRASLACIÓN) ===")
     
-    if not diccionario_dicom:
+    if not diccionario_dicom and not gestor_trabajos.pendientes():
         print("Error: No hay archivos DICOM procesados. Primero ejecute la opción 'a'.")
         return
     
@@ -159,17 +462,25 @@ def opcion_d_transformacion_geometrica():
     print("Claves DICOM disponibles:")
     for clave in diccionario_dicom.keys():
         print(f"  - {clave}")
+    for clave, trabajo in cargas_pendientes.items():
+        if not trabajo.terminado:
+            print(f"  - {clave} (cargando {trabajo.hechos}/{trabajo.total})")
     
-    clave_dicom = input("Ingrese la clave del DICOM a transformar: ")
+    clave_dicom = leer("Ingrese la clave del DICOM a transformar: ")
     
+    if clave_en_carga(clave_dicom):
+        return
     if clave_dicom not in diccionario_dicom:
         print("Error: Clave no encontrada.")
         return
     
     # Obtener un corte del volumen DICOM
-    volumen_3d = diccionario_dicom[clave_dicom]['volumen_3d']
-    # Usar el corte central
-    imagen_original = volumen_3d[volumen_3d.shape[0]//2, :, :].astype(np.uint8)
+    datos_dicom = diccionario_dicom[clave_dicom]
+    volumen_3d = datos_dicom['volumen_3d']
+    # Usar el corte central conservando su tipo de dato (12/16 bits)
+    indice_central = volumen_3d.shape[0]//2
+    imagen_original = volumen_3d[indice_central, :, :]
+    parametros = Ventaneo.parametros_cabecera(datos_dicom['archivos_dicom'][indice_central])
     
     # Opciones de traslación predefinidas
     print("\nOpciones de traslación:")
@@ -183,7 +494,7 @@ def opcion_d_transformacion_geometrica():
     for key, (tx, ty) in opciones_traslacion.items():
         print(f"{key}. Traslación X={tx}, Y={ty}")
     
-    opcion = input("Seleccione una opción (1-4): ")
+    opcion = leer("Seleccione una opción (1-4): ")
     
     if opcion not in opciones_traslacion:
         print("Opción no válida.")
@@ -191,72 +502,92 @@ def opcion_d_transformacion_geometrica():
     
     tx, ty = opciones_traslacion[opcion]
     
-    # Aplicar traslación
+    # Aplicar traslación sobre los valores almacenados
     imagen_trasladada = ProcesadorDICOM.trasladar_imagen(imagen_original, tx, ty)
     
-    # Mostrar resultado
-    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
-    
-    axes[0].imshow(imagen_original, cmap='gray')
-    axes[0].set_title('Imagen Original')
-    axes[0].axis('off')
+    # Ventana de visualización (rescale y ventana de la cabecera, o un preset)
+    ventanas = ['dicom', 'completo'] + list(Ventaneo.PRESETS)
+    ventana = leer(f"Ventana para visualizar ({'/'.join(ventanas)}, recomendado dicom): ").lower() or 'dicom'
+    if ventana not in ventanas:
+        print("Ventana no válida, se usa la de la cabecera.")
+        ventana = 'dicom'
     
-    axes[1].imshow(imagen_trasladada, cmap='gray')
-    axes[1].set_title(f'Imagen Trasladada (X={tx}, Y={ty})')
-    axes[1].axis('off')
-    
-    plt.tight_layout()
-    plt.show()
+    while True:
+        # La ventana se resuelve con la original y se aplica igual a las dos, para que
+        # 'completo' no estire cada imagen con su propio mínimo y máximo
+        ventana_fija = Ventaneo.resolver_ventana(imagen_original, ventana, parametros)
+        original_8bits = Ventaneo.a_uint8(imagen_original, ventana_fija, parametros)
+        trasladada_8bits = Ventaneo.a_uint8(imagen_trasladada, ventana_fija, parametros)
+        
+        # Mostrar resultado
+        ProcesadorDICOM.mostrar_traslacion(original_8bits, trasladada_8bits, tx, ty)
+        
+        # Las tablas de la cabecera y los presets quedan en caché, volver a ellas es inmediato
+        otra = leer(f"Otra ventana ({'/'.join(ventanas)}) o Enter para guardar: ").lower()
+        if otra not in ventanas:
+            break
+        ventana = otra
     
-    # Guardar imagen trasladada
+    # Guardar imagen trasladada en 8 bits con la ventana elegida
     nombre_archivo = f"imagen_trasladada_{clave_dicom}_X{tx}_Y{ty}.png"
-    cv2.imwrite(nombre_archivo, imagen_trasladada)
-    print(f"Imagen trasladada guardada como: {nombre_archivo}")
+    cv2.imwrite(nombre_archivo, trasladada_8bits)
+    print(f"Imagen trasladada guardada como: {nombre_archivo} (ventana: {ventana})")
 
+@Instrumentacion.instrumentar
 def opcion_e_procesamiento_imagenes():
     """Opción e: Procesamiento de imágenes JPG/PNG"""
     print("\n=== PROCESAMIENTO DE IMÁGENES JPG/PNG ===")
     
-    # Mostrar imágenes disponibles (solo las que no son DICOM)
-    imagenes_disponibles = {k: v for k, v in diccionario_imagenes.items() 
-                          if v.get('tipo') == 'imagen_comun'}
+    # Mostrar imágenes disponibles (solo las que no son DICOM), sin cargarlas
+    imagenes_disponibles = diccionario_imagenes.claves('imagen_comun')
     
     if not imagenes_disponibles:
         print("Error: No hay imágenes JPG/PNG disponibles. Primero ejecute la opción 'c'.")
         return
     
+    reducciones = diccionario_imagenes.reducciones()
     print("Imágenes disponibles:")
-    for clave in imagenes_disponibles.keys():
-        print(f"  - {clave}")
+    for clave in imagenes_disponibles:
+        aviso = f" (vista previa a 1/{reducciones[clave]})" if clave in reducciones else ""
+        print(f"  - {clave}{aviso}")
     
-    clave_imagen = input("Ingrese la clave de la imagen a procesar: ")
+    clave_imagen = leer("Ingrese la clave de la imagen a procesar: ")
     
     if clave_imagen not in imagenes_disponibles:
         print("Error: Clave no encontrada.")
         return
     
-    imagen_original = imagenes_disponibles[clave_imagen]['imagen']
+    imagen_original = diccionario_imagenes[clave_imagen]['imagen']
+    if clave_imagen in reducciones:
+        print(f"Atención: '{clave_imagen}' es una vista previa a 1/{reducciones[clave_imagen]} de la "
+              "resolución original; los resultados no corresponden a la imagen completa.")
     
     # Menú de binarización
     ProcesadorImagenes.mostrar_menu_binarizacion()
-    tipo_binarizacion = input("Seleccione el tipo de binarización (1-5): ")
+    tipo_binarizacion = leer("Seleccione el tipo de binarización (1-5): ")
     
     if tipo_binarizacion not in ProcesadorImagenes.TIPOS_BINARIZACION:
         print("Opción no válida.")
         return
     
     # Umbral para binarización
-    umbral = int(input("Ingrese el valor del umbral (0-255, recomendado 127): ") or "127")
+    umbral = leer("Ingrese el valor del umbral (0-255, recomendado 127, u 'otsu'/'triangulo'): ") or "127"
+    if umbral.lower() in ('otsu', 'triangulo'):
+        histograma = ProcesadorImagenes.calcular_histograma(imagen_original)
+        umbral = ProcesadorImagenes.umbral_automatico(histograma, umbral.lower())
+        print(f"Umbral calculado automáticamente: {umbral}")
+    else:
+        umbral = int(umbral)
     
     # Binarizar imagen
     imagen_binarizada = ProcesadorImagenes.binarizar_imagen(imagen_original, tipo_binarizacion, umbral)
     
     # Transformación morfológica
-    kernel_size = int(input("Ingrese el tamaño del kernel para morfología (ej: 5): ") or "5")
+    kernel_size = int(leer("Ingrese el tamaño del kernel para morfología (ej: 5): ") or "5")
     imagen_morfologica = ProcesadorImagenes.aplicar_morfologia(imagen_binarizada, kernel_size)
     
     # Dibujar forma con texto
-    forma = input("¿Qué forma desea dibujar? (circulo/cuadrado): ").lower()
+    forma = leer("¿Qué forma desea dibujar? (circulo/cuadrado): ").lower()
     if forma not in ['circulo', 'cuadrado']:
         forma = 'circulo'
     
@@ -266,67 +597,293 @@ def opcion_e_procesamiento_imagenes():
     )
     
     # Mostrar resultados
-    fig, axes = plt.subplots(2, 2, figsize=(12, 10))
-    
-    # Imagen original
-    if len(imagen_original.shape) == 3:
-        axes[0,0].imshow(cv2.cvtColor(imagen_original, cv2.COLOR_BGR2RGB))
-    else:
-        axes[0,0].imshow(imagen_original, cmap='gray')
-    axes[0,0].set_title('Imagen Original')
-    axes[0,0].axis('off')
-    
-    # Imagen binarizada
-    axes[0,1].imshow(imagen_binarizada, cmap='gray')
-    axes[0,1].set_title(f'Binarizada ({tipo_bin_nombre})')
-    axes[0,1].axis('off')
-    
-    # Imagen con morfología
-    axes[1,0].imshow(imagen_morfologica, cmap='gray')
-    axes[1,0].set_title(f'Morfología (Kernel {kernel_size}x{kernel_size})')
-    axes[1,0].axis('off')
-    
-    # Imagen final con forma y texto
-    if len(imagen_final.shape) == 3:
-        axes[1,1].imshow(cv2.cvtColor(imagen_final, cv2.COLOR_BGR2RGB))
-    else:
-        axes[1,1].imshow(imagen_final, cmap='gray')
-    axes[1,1].set_title(f'Resultado Final ({forma})')
-    axes[1,1].axis('off')
-    
-    plt.tight_layout()
-    plt.show()
+    ProcesadorImagenes.mostrar_procesamiento(
+        imagen_original, imagen_binarizada, imagen_morfologica, imagen_final,
+        tipo_bin_nombre, kernel_size, forma
+    )
     
     # Guardar imagen final
     nombre_archivo = f"imagen_procesada_{clave_imagen}_{tipo_bin_nombre}_{forma}.png"
     cv2.imwrite(nombre_archivo, imagen_final)
     print(f"Imagen procesada guardada como: {nombre_archivo}")
 
+@Instrumentacion.instrumentar
+def opcion_h_proyecciones():
+    """Opción h: Proyecciones de intensidad, losas gruesas y planos oblicuos"""
+    print("\n=== PROYECCIONES Y PLANOS OBLICUOS ===")
+    
+    if not diccionario_dicom and not gestor_trabajos.pendientes():
+        print("Error: No hay archivos DICOM procesados. Primero ejecute la opción 'a'.")
+        return
+    
+    # Mostrar claves disponibles
+    print("Claves DICOM disponibles:")
+    for clave in diccionario_dicom.keys():
+        print(f"  - {clave}")
+    
+    clave_dicom = leer("Ingrese la clave del DICOM a proyectar: ")
+    
+    if clave_en_carga(clave_dicom):
+        return
+    if clave_dicom not in diccionario_dicom:
+        print("Error: Clave no encontrada.")
+        return
+    
+    datos_dicom = diccionario_dicom[clave_dicom]
+    volumen_3d = datos_dicom['volumen_3d']
+    parametros = Ventaneo.parametros_cabecera(datos_dicom['archivos_dicom'][volumen_3d.shape[0]//2])
+    
+    tipo = leer(f"Tipo de proyección ({'/'.join(Proyecciones.TIPOS)}, recomendado mip): ").lower() or 'mip'
+    if tipo not in Proyecciones.TIPOS:
+        print("Opción no válida.")
+        return
+    
+    print("\n1. Volumen completo en los tres ejes")
+    print("2. Losa gruesa")
+    print("3. Plano oblicuo")
+    modo = leer("Seleccione una opción (1-3): ")
+    
+    try:
+        if modo == '1':
+            imagenes = [Proyecciones.proyectar(volumen_3d, tipo, eje) for eje in Proyecciones.EJES]
+            titulos = [f"{tipo.upper()} {eje}" for eje in Proyecciones.EJES]
+            sufijos = [f"{tipo}_{eje}" for eje in Proyecciones.EJES]
+        elif modo == '2':
+            eje = leer(f"Eje ({'/'.join(Proyecciones.EJES)}): ").lower()
+            if eje not in Proyecciones.EJES:
+                print("Opción no válida.")
+                return
+            numero = volumen_3d.shape[Proyecciones.EJES[eje]]
+            posicion = int(leer(f"Posición del centro de la losa (0-{numero - 1}): ") or numero // 2)
+            grosor = int(leer("Grosor en planos (ej: 10): ") or "10")
+            imagenes = [Proyecciones.losa(volumen_3d, posicion, grosor, tipo, eje)]
+            titulos = [f"{tipo.upper()} {eje}, losa de {grosor} en {posicion}"]
+            sufijos = [f"{tipo}_{eje}_losa{grosor}_{posicion}"]
+        elif modo == '3':
+            texto = leer("Rotación en grados alrededor de x, y, z (ej: 30,0,0): ") or "30,0,0"
+            rotacion = tuple(float(valor) for valor in texto.split(','))
+            grosor = int(leer("Grosor en planos (1 para un corte simple): ") or "1")
+            if len(rotacion) != 3:
+                print("Opción no válida.")
+                return
+            imagenes = [Proyecciones.plano_oblicuo(volumen_3d, rotacion_grados=rotacion, grosor=grosor,
+                                                   tipo=tipo)]
+            titulos = [f"Plano oblicuo {rotacion}, {tipo.upper()} de {grosor}"]
+            sufijos = [f"{tipo}_oblicuo_{'_'.join(f'{angulo:g}' for angulo in rotacion)}_grosor{grosor}"]
+        else:
+            print("Opción no válida.")
+            return
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    
+    # Misma ventana de la cabecera del corte central para todas las proyecciones
+    imagenes = [Ventaneo.a_uint8(imagen, 'dicom', parametros) for imagen in imagenes]
+    Proyecciones.mostrar(imagenes, titulos, f"Proyecciones - {clave_dicom}")
+    
+    for imagen, sufijo in zip(imagenes, sufijos):
+        nombre_archivo = f"proyeccion_{clave_dicom}_{sufijo}.png"
+        cv2.imwrite(nombre_archivo, imagen)
+        print(f"Proyección guardada como: {nombre_archivo}")
+
+@Instrumentacion.instrumentar
+def opcion_i_segmentacion_3d():
+    """Opción i: Umbral, apertura y componentes conexas sobre el volumen completo"""
+    print("\n=== SEGMENTACIÓN 3D ===")
+    
+    if not diccionario_dicom and not gestor_trabajos.pendientes():
+        print("Error: No hay archivos DICOM procesados. Primero ejecute la opción 'a'.")
+        return
+    
+    # Mostrar claves disponibles
+    print("Claves DICOM disponibles:")
+    for clave in diccionario_dicom.keys():
+        print(f"  - {clave}")
+    
+    clave_dicom = leer("Ingrese la clave del DICOM a segmentar: ")
+    
+    if clave_en_carga(clave_dicom):
+        return
+    if clave_dicom not in diccionario_dicom:
+        print("Error: Clave no encontrada.")
+        return
+    
+    datos_dicom = diccionario_dicom[clave_dicom]
+    # El volumen guardado se lee por bloques de cortes, sin cargarlo completo en RAM
+    volumen_3d = datos_dicom['volumen_3d']
+    archivos_dicom = datos_dicom['archivos_dicom']
+    
+    # Mismos tipos de umbral que la binarización de imágenes
+    ProcesadorImagenes.mostrar_menu_binarizacion()
+    tipo_binarizacion = leer("Seleccione el tipo de binarización (1-5): ")
+    
+    if tipo_binarizacion not in ProcesadorImagenes.TIPOS_BINARIZACION:
+        print("Opción no válida.")
+        return
+    
+    try:
+        umbral = float(leer("Umbral en unidades de la cabecera (HU en TC, ej: 300): ") or "300")
+        kernel_size = int(leer("Tamaño del kernel de la apertura 3D (1 para no abrir, ej: 3): ") or "3")
+        conectividad = int(leer("Conectividad (6/26, recomendado 26): ") or "26")
+        volumen_minimo = int(leer("Descartar componentes de menos de cuántos voxeles (ej: 10): ") or "10")
+    except ValueError:
+        print("Opción no válida.")
+        return
+    
+    guardar = leer("¿Guardar el volumen de etiquetas en .npy? (s/n): ").lower() == 's'
+    ruta_etiquetas = None
+    if guardar:
+        ruta_etiquetas = os.path.join(carpeta_resultados('Segmentaciones'), f"etiquetas_{clave_dicom}.npy")
+    
+    try:
+        componentes, etiquetas = Segmentacion3D.segmentar(
+            volumen_3d, tipo_binarizacion, umbral, kernel_size, conectividad=conectividad,
+            archivos_dicom=archivos_dicom, volumen_minimo=volumen_minimo, ruta_etiquetas=ruta_etiquetas)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    
+    if not componentes:
+        print("No quedaron componentes con esos parámetros.")
+        return
+    
+    total_ml = sum(componente['volumen_ml'] for componente in componentes)
+    print(f"\n{len(componentes)} componentes, {total_ml:.3f} ml en total")
+    print("\n".join(Segmentacion3D.lineas_resumen(componentes)))
+    
+    if etiquetas is not None:
+        print(f"Volumen de etiquetas guardado como: {ruta_etiquetas}")
+        # Vista rápida: proyección de las etiquetas en los tres ejes
+        imagenes = [Ventaneo.a_uint8(Proyecciones.proyectar(etiquetas, 'mip', eje), 'completo')
+                    for eje in Proyecciones.EJES]
+        Proyecciones.mostrar(imagenes, [f"Etiquetas {eje}" for eje in Proyecciones.EJES],
+                             f"Segmentación 3D - {clave_dicom}")
+
+@Instrumentacion.instrumentar
+def opcion_j_catalogo():
+    """Opción j: Catálogo de cabeceras del banco DICOM, búsqueda y carga de series"""
+    print("\n=== CATÁLOGO DEL BANCO DICOM ===")
+    
+    estadisticas = catalogo.estadisticas()
+    print(f"Catálogo: {estadisticas['pacientes']} pacientes, {estadisticas['estudios']} estudios, "
+          f"{estadisticas['series']} series, {estadisticas['archivos']} archivos")
+    print("\n1. Escanear o actualizar una carpeta raíz")
+    print("2. Buscar series y cargar una")
+    modo = leer("Seleccione una opción (1-2): ")
+    
+    if modo == '1':
+        raiz = leer("Ingrese la carpeta raíz (Enter para 'Banco Dicom'): ") or 'Banco Dicom'
+        if not os.path.isdir(raiz):
+            print("Error: La ruta especificada no existe.")
+            return
+        # Solo se leen las cabeceras de los archivos nuevos o modificados
+        en_segundo_plano(f"Actualización del catálogo '{raiz}'",
+                         lambda trabajo: catalogo.actualizar(raiz, progreso=trabajo.progreso),
+                         informar_actualizacion)
+        return
+    if modo != '2':
+        print("Opción no válida.")
+        return
+    
+    texto = leer("Nombre o ID del paciente (Enter para todos): ") or None
+    modalidad = leer("Modalidad (CT, MR... Enter para todas): ") or None
+    resultados = catalogo.buscar_series(nombre=texto, modalidad=modalidad)
+    if texto is not None:
+        resultados += [fila for fila in catalogo.buscar_series(id_paciente=texto, modalidad=modalidad)
+                       if fila not in resultados]
+    if not resultados:
+        print("No se encontraron series. Escanee primero la carpeta raíz (opción 1).")
+        return
+    
+    for i, fila in enumerate(resultados, 1):
+        print(f"{i}. {fila['nombre']} ({fila['id_paciente']}) - {fila['modalidad']} {fila['descripcion']}: "
+              f"{fila['num_cortes']} cortes de {fila['filas']}x{fila['columnas']} [{fila['carpeta']}]")
+    seleccion = leer(f"Seleccione la serie a cargar (1-{len(resultados)}, Enter para volver): ")
+    if not seleccion:
+        return
+    if not seleccion.isdigit() or not 1 <= int(seleccion) <= len(resultados):
+        print("Opción no válida.")
+        return
+    fila = resultados[int(seleccion) - 1]
+    ruta_carpeta, serie_uid = fila['carpeta'], fila['serie_uid']
+    
+    def releer(trabajo):
+        # Reescaneo incremental de la carpeta para no cargar con cabeceras desactualizadas
+        catalogo.actualizar(ruta_carpeta, progreso=trabajo.progreso)
+        resumen_series = catalogo.resumen_carpeta(ruta_carpeta)
+        if not any(s['serie_uid'] == serie_uid for s in resumen_series):
+            return resumen_series, None
+        return resumen_series, catalogo.serie(serie_uid, ruta_carpeta)
+    
+    def continuar(resultado):
+        resumen_series, serie = resultado
+        if serie is None:
+            print("Error: La serie seleccionada ya no está en la carpeta.")
+            return
+        cargar_serie_seleccionada(ruta_carpeta, resumen_series, serie_uid, serie)
+    
+    en_segundo_plano(f"Actualización de '{ruta_carpeta}' en el catálogo", releer, continuar)
+
+def informar_actualizacion(resumen):
+    """Muestra el resultado de CatalogoDICOM.actualizar"""
+    print(f"Catálogo actualizado: {resumen['nuevos']} nuevos, {resumen['modificados']} modificados, "
+          f"{resumen['eliminados']} eliminados, {resumen['sin_cambios']} sin cambios, "
+          f"{resumen['errores']} con errores")
+
+def guardar_rendimiento():
+    """Exporta los tiempos por etapa de la sesión a JSON y muestra el resumen"""
+    ruta = f"rendimiento_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    Instrumentacion.exportar_json(ruta)
+    print("\n" + "\n".join(Instrumentacion.lineas_resumen()))
+    print(f"Tiempos por etapa guardados en: {ruta}")
+
 def main():
     """Función principal con el menú"""
     print("¡Bienvenido al Sistema de Procesamiento de Imágenes Médicas!")
+    inicializar()
     
-    while True:
-        mostrar_menu_principal()
-        opcion = input("\nSeleccione una opción: ").lower()
-        
-        if opcion == 'a':
-            opcion_a_procesar_dicom()
-        elif opcion == 'b':
-            opcion_b_ingresar_paciente()
-        elif opcion == 'c':
-            opcion_c_ingresar_imagenes()
-        elif opcion == 'd':
-            opcion_d_transformacion_geometrica()
-        elif opcion == 'e':
-            opcion_e_procesamiento_imagenes()
-        elif opcion == 'f':
-            print("\n¡Gracias por usar el sistema! Hasta luego.")
-            break
-        else:
-            print("Opción no válida. Por favor, seleccione una opción del menú.")
-        
-        input("\nPresione Enter para continuar...")
+    # Las ventanas de matplotlib no detienen el menú mientras hay cargas en curso
+    ProcesadorDICOM.mostrar_sin_bloquear = True
+    
+    # Al salir por error, Ctrl+C o fin de la entrada también se cierran las cachés y
+    # se exportan los tiempos de la sesión
+    try:
+        while True:
+            avisar_trabajos_terminados()
+            mostrar_menu_principal()
+            opcion = leer("\nSeleccione una opción: ").lower()
+            
+            if opcion == 'a':
+                opcion_a_procesar_dicom()
+            elif opcion == 'b':
+                opcion_b_ingresar_paciente()
+            elif opcion == 'c':
+                opcion_c_ingresar_imagenes()
+            elif opcion == 'd':
+                opcion_d_transformacion_geometrica()
+            elif opcion == 'e':
+                opcion_e_procesamiento_imagenes()
+            elif opcion == 'g':
+                opcion_g_trabajos()
+            elif opcion == 'h':
+                opcion_h_proyecciones()
+            elif opcion == 'i':
+                opcion_i_segmentacion_3d()
+            elif opcion == 'j':
+                opcion_j_catalogo()
+            elif opcion == 'f':
+                break
+            else:
+                print("Opción no válida. Por favor, seleccione una opción del menú.")
+            
+            leer("\nPresione Enter para continuar...")
+    finally:
+        try:
+            finalizar()
+        finally:
+            if Instrumentacion.activa:
+                guardar_rendimiento()
+    print("\n¡Gracias por usar el sistema! Hasta luego.")
 
 if __name__ == "__main__":
     # Verificar que se tienen las librerías necesarias
@@ -336,7 +893,20 @@ if __name__ == "__main__":
         import numpy as np
         import matplotlib.pyplot as plt
         print("Todas las librerías necesarias están instaladas.")
-        main()
+        argumentos = sys.argv[1:]
+        if '--instrumentar' in argumentos or '--instrumentar-memoria' in argumentos:
+            # Tiempos por etapa; con --instrumentar-memoria también el pico de tracemalloc
+            Instrumentacion.activar(memoria='--instrumentar-memoria' in argumentos)
+            argumentos = [a for a in argumentos if a not in ('--instrumentar', '--instrumentar-memoria')]
+        if len(argumentos) == 2 and argumentos[0] == '--lote':
+            # Modo por lotes sin menú ni ventanas
+            from lote import ejecutar_lote
+            instrumentar = None
+            if Instrumentacion.activa:
+                instrumentar = 'memoria' if '--instrumentar-memoria' in sys.argv else True
+            ejecutar_lote(argumentos[1], instrumentar)
+        else:
+            main()
     except ImportError as e:
         print(f"Error: Falta instalar una librería: {e}")
         print("Instale las librerías necesarias:")
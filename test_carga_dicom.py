@@ -0,0 +1,70 @@
+"""Pruebas de la carga paralela de ProcesadorDICOM.cargar_carpeta_dicom frente a la secuencial"""
+
+import os
+import shutil
+
+import numpy as np
+import pydicom
+import pytest
+
+from clases import ProcesadorDICOM
+
+CARPETA_T2 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Banco Dicom', 'T2')
+
+
+@pytest.fixture(scope='module')
+def carpeta(tmp_path_factory):
+    """Algunos cortes de T2 desordenados, un .dcm ilegible y uno con los pixeles truncados"""
+    carpeta = tmp_path_factory.mktemp('dicom')
+    originales = sorted(archivo for archivo in os.listdir(CARPETA_T2) if archivo.lower().endswith('.dcm'))
+    for numero, archivo in enumerate(originales[:8]):
+        shutil.copy2(os.path.join(CARPETA_T2, archivo), carpeta / f"{(numero * 5) % 8}_{archivo}")
+    (carpeta / '3_roto.dcm').write_bytes(b'esto no es un archivo DICOM')
+    (carpeta / 'vacio.dcm').write_bytes(b'')
+    truncado = pydicom.dcmread(os.path.join(CARPETA_T2, originales[8]))
+    truncado.PixelData = truncado.PixelData[:len(truncado.PixelData) // 2]
+    truncado.save_as(carpeta / '5_truncado.dcm')
+    return str(carpeta)
+
+
+def cargar(carpeta, capsys, **opciones):
+    archivos_dicom, nombres_archivos = ProcesadorDICOM.cargar_carpeta_dicom(carpeta, **opciones)
+    return archivos_dicom, nombres_archivos, capsys.readouterr().out
+
+
+@pytest.mark.parametrize('usar_procesos', [False, True])
+@pytest.mark.parametrize('max_trabajadores', [None, 3])
+def test_paralelo_igual_a_secuencial(carpeta, capsys, usar_procesos, max_trabajadores):
+    secuencial, nombres_secuencial, salida_secuencial = cargar(carpeta, capsys)
+
+    paralelo, nombres_paralelo, salida_paralela = cargar(
+        carpeta, capsys, paralelo=True, max_trabajadores=max_trabajadores, usar_procesos=usar_procesos)
+
+    assert nombres_paralelo == nombres_secuencial
+    assert [ds.SOPInstanceUID for ds in paralelo] == [ds.SOPInstanceUID for ds in secuencial]
+    assert salida_paralela == salida_secuencial
+    for ds_paralelo, ds_secuencial in zip(paralelo, secuencial):
+        if ds_secuencial.SOPInstanceUID == pydicom.dcmread(os.path.join(carpeta, '5_truncado.dcm'),
+                                                           stop_before_pixels=True).SOPInstanceUID:
+            continue
+        assert np.array_equal(ds_paralelo.pixel_array, ds_secuencial.pixel_array)
+
+
+def test_errores_por_archivo_en_orden(carpeta, capsys):
+    _, nombres_archivos, salida = cargar(carpeta, capsys, paralelo=True)
+
+    # Mismo orden que os.listdir, con los ilegibles omitidos y avisados en ese orden
+    listados = [archivo for archivo in os.listdir(carpeta) if archivo.endswith('.dcm')]
+    ilegibles = ['3_roto.dcm', 'vacio.dcm']
+    errores = [linea.split(':')[0] for linea in salida.splitlines()]
+    assert errores == [f"Error al leer {archivo}" for archivo in listados if archivo in ilegibles]
+    assert nombres_archivos == [archivo for archivo in listados if archivo not in ilegibles]
+    assert '5_truncado.dcm' in nombres_archivos
+
+
+def test_pixeles_truncados_fallan_al_usarlos_en_ambos_modos(carpeta, capsys):
+    for opciones in ({}, {'paralelo': True}, {'paralelo': True, 'usar_procesos': True}):
+        archivos_dicom, nombres_archivos, _ = cargar(carpeta, capsys, **opciones)
+        truncado = archivos_dicom[nombres_archivos.index('5_truncado.dcm')]
+        with pytest.raises(Exception):
+            truncado.pixel_array
@@ -0,0 +1,83 @@
+"""Pruebas del reescaneo incremental de CatalogoDICOM"""
+
+import os
+import shutil
+
+import pytest
+
+from clases import CatalogoDICOM
+
+CARPETA_T2 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Banco Dicom', 'T2')
+
+
+@pytest.fixture
+def banco(tmp_path):
+    """Copia de la serie T2 en una carpeta temporal, para poder modificarla"""
+    carpeta = tmp_path / 'banco' / 'T2'
+    carpeta.mkdir(parents=True)
+    for archivo in sorted(os.listdir(CARPETA_T2)):
+        if archivo.lower().endswith('.dcm'):
+            shutil.copy2(os.path.join(CARPETA_T2, archivo), carpeta / archivo)
+    return carpeta
+
+
+@pytest.fixture
+def catalogo(tmp_path):
+    catalogo = CatalogoDICOM(str(tmp_path / 'catalogo.sqlite'))
+    yield catalogo
+    catalogo.cerrar()
+
+
+def test_primer_escaneo_registra_todos_los_archivos(banco, catalogo):
+    archivos = sorted(os.listdir(banco))
+
+    resumen = catalogo.actualizar(str(banco.parent), paralelo=False)
+
+    assert resumen == {'nuevos': len(archivos), 'modificados': 0, 'eliminados': 0,
+                       'sin_cambios': 0, 'errores': 0}
+    series = catalogo.resumen_carpeta(str(banco))
+    assert len(series) == 1
+    assert series[0]['num_cortes'] == len(archivos)
+
+
+def test_reescaneo_sin_cambios_no_relee_nada(banco, catalogo):
+    total = len(os.listdir(banco))
+    catalogo.actualizar(str(banco.parent), paralelo=False)
+
+    resumen = catalogo.actualizar(str(banco.parent), paralelo=False)
+
+    assert resumen == {'nuevos': 0, 'modificados': 0, 'eliminados': 0,
+                       'sin_cambios': total, 'errores': 0}
+
+
+def test_reescaneo_detecta_nuevos_modificados_y_eliminados(banco, catalogo):
+    archivos = sorted(os.listdir(banco))
+    catalogo.actualizar(str(banco.parent), paralelo=False)
+
+    # Uno modificado (otra fecha), uno eliminado y uno nuevo
+    modificado = banco / archivos[0]
+    estado = modificado.stat()
+    os.utime(modificado, ns=(estado.st_atime_ns, estado.st_mtime_ns + 10 ** 9))
+    (banco / archivos[1]).unlink()
+    shutil.copy2(os.path.join(CARPETA_T2, archivos[1]), banco / 'nuevo.dcm')
+
+    resumen = catalogo.actualizar(str(banco.parent), paralelo=False)
+
+    assert resumen == {'nuevos': 1, 'modificados': 1, 'eliminados': 1,
+                       'sin_cambios': len(archivos) - 2, 'errores': 0}
+    serie = catalogo.serie(catalogo.resumen_carpeta(str(banco))[0]['serie_uid'], str(banco))
+    assert 'nuevo.dcm' in serie['nombres_archivos']
+    assert archivos[1] not in serie['nombres_archivos']
+    assert len(serie['rutas']) == len(archivos)
+
+
+def test_carpeta_borrada_deja_el_catalogo_vacio(banco, catalogo):
+    total = len(os.listdir(banco))
+    catalogo.actualizar(str(banco.parent), paralelo=False)
+
+    shutil.rmtree(banco)
+    resumen = catalogo.actualizar(str(banco.parent), paralelo=False)
+
+    assert resumen['eliminados'] == total
+    assert catalogo.resumen_carpeta(str(banco)) == []
+    assert catalogo.estadisticas()['archivos'] == 0
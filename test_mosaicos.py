@@ -0,0 +1,76 @@
+"""Pruebas de ProcesadorImagenes.procesar_en_mosaicos contra la cadena sobre la imagen completa"""
+
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from clases import ProcesadorImagenes
+
+CARPETA_IMAGENES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Banco JPG o PNG')
+
+
+def cadena_completa(imagen, tipo_binarizacion, umbral, kernel_size, forma, operacion='apertura'):
+    """Opción e) sobre la imagen entera, como en el menú"""
+    if isinstance(umbral, str):
+        umbral = ProcesadorImagenes.umbral_automatico(ProcesadorImagenes.calcular_histograma(imagen), umbral)
+    binarizada = ProcesadorImagenes.binarizar_imagen(imagen, tipo_binarizacion, umbral)
+    morfologica = ProcesadorImagenes.aplicar_morfologia(binarizada, kernel_size, operacion)
+    tipo_bin_nombre = ProcesadorImagenes.TIPOS_BINARIZACION[tipo_binarizacion][0]
+    return ProcesadorImagenes.dibujar_forma_con_texto(
+        morfologica, forma, f"Imagen binarizada ({tipo_bin_nombre})", umbral, kernel_size)
+
+
+@pytest.fixture(scope='module')
+def imagen():
+    ruta = sorted(os.path.join(CARPETA_IMAGENES, archivo) for archivo in os.listdir(CARPETA_IMAGENES)
+                  if archivo.lower().endswith(ProcesadorImagenes.EXTENSIONES))[0]
+    return ProcesadorImagenes.cargar_imagen(ruta, 'gris')
+
+
+@pytest.mark.parametrize('tamano_mosaico', [64, 100, 4096])
+@pytest.mark.parametrize('forma', ['circulo', 'cuadrado'])
+def test_mosaicos_igual_a_imagen_completa(imagen, tamano_mosaico, forma):
+    salida = np.zeros(imagen.shape[:2] + (3,), dtype=np.uint8)
+
+    resultado, umbral = ProcesadorImagenes.procesar_en_mosaicos(
+        imagen, salida, '1', 127, 7, forma, tamano_mosaico=tamano_mosaico)
+
+    assert umbral == 127
+    assert np.array_equal(resultado, cadena_completa(imagen, '1', 127, 7, forma))
+
+
+@pytest.mark.parametrize('metodo', ['otsu', 'triangulo'])
+def test_umbral_automatico_por_mosaicos(imagen, metodo):
+    salida = np.zeros(imagen.shape[:2] + (3,), dtype=np.uint8)
+
+    resultado, umbral = ProcesadorImagenes.procesar_en_mosaicos(
+        imagen, salida, '2', metodo, 5, 'circulo', tamano_mosaico=128)
+
+    histograma = ProcesadorImagenes.calcular_histograma(imagen)
+    assert umbral == ProcesadorImagenes.umbral_automatico(histograma, metodo)
+    assert np.array_equal(resultado, cadena_completa(imagen, '2', metodo, 5, 'circulo'))
+
+
+@pytest.mark.parametrize('operacion', ['cierre', 'gradiente'])
+def test_otras_operaciones_y_sin_hilos(imagen, operacion):
+    salida = np.zeros(imagen.shape[:2] + (3,), dtype=np.uint8)
+
+    resultado, _ = ProcesadorImagenes.procesar_en_mosaicos(
+        imagen, salida, '1', 100, 9, 'cuadrado', operacion=operacion, tamano_mosaico=96, paralelo=False)
+
+    assert np.array_equal(resultado, cadena_completa(imagen, '1', 100, 9, 'cuadrado', operacion))
+
+
+def test_salida_png_y_npy_sin_temporales(imagen, tmp_path):
+    ruta_png = str(tmp_path / 'resultado.png')
+    ruta_npy = str(tmp_path / 'resultado.npy')
+    esperado = cadena_completa(imagen, '1', 127, 5, 'circulo')
+
+    ProcesadorImagenes.procesar_en_mosaicos(imagen, ruta_png, '1', 127, 5, tamano_mosaico=128)
+    ProcesadorImagenes.procesar_en_mosaicos(imagen, ruta_npy, '1', 127, 5, tamano_mosaico=128)
+
+    assert np.array_equal(cv2.imread(ruta_png), esperado)
+    assert np.array_equal(np.load(ruta_npy), esperado)
+    assert sorted(os.listdir(tmp_path)) == ['resultado.npy', 'resultado.png']
@@ -0,0 +1,84 @@
+"""Pruebas de las componentes conexas 3D por bloques (union-find) de Segmentacion3D"""
+
+from collections import deque
+from itertools import product
+
+import numpy as np
+import pytest
+
+from clases import Segmentacion3D
+
+
+def etiquetar_por_inundacion(mascara, conectividad):
+    """Etiquetado de referencia: recorrido en anchura voxel a voxel"""
+    if conectividad == 6:
+        vecinos = [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)]
+    else:
+        vecinos = [d for d in product((-1, 0, 1), repeat=3) if d != (0, 0, 0)]
+    etiquetas = np.zeros(mascara.shape, dtype=np.int32)
+    siguiente = 0
+    for inicio in zip(*np.nonzero(mascara)):
+        if etiquetas[inicio]:
+            continue
+        siguiente += 1
+        etiquetas[inicio] = siguiente
+        pendientes = deque([inicio])
+        while pendientes:
+            z, y, x = pendientes.popleft()
+            for dz, dy, dx in vecinos:
+                vecino = (z + dz, y + dy, x + dx)
+                if all(0 <= c < n for c, n in zip(vecino, mascara.shape)) \
+                        and mascara[vecino] and not etiquetas[vecino]:
+                    etiquetas[vecino] = siguiente
+                    pendientes.append(vecino)
+    return etiquetas
+
+
+def volumen_aleatorio(semilla, forma=(11, 17, 19), densidad=0.3):
+    rng = np.random.default_rng(semilla)
+    return np.where(rng.random(forma) < densidad, 200, 0).astype(np.uint8)
+
+
+@pytest.mark.parametrize('conectividad', [6, 26])
+@pytest.mark.parametrize('cortes_por_bloque', [1, 3, 32])
+def test_etiquetas_iguales_a_la_inundacion(tmp_path, conectividad, cortes_por_bloque):
+    volumen = volumen_aleatorio(conectividad + cortes_por_bloque)
+    referencia = etiquetar_por_inundacion(volumen > 127, conectividad)
+
+    componentes, etiquetas = Segmentacion3D.segmentar(
+        volumen, '1', 127, kernel_size=1, conectividad=conectividad,
+        ruta_etiquetas=str(tmp_path / 'etiquetas.npy'), cortes_por_bloque=cortes_por_bloque)
+    etiquetas = np.asarray(etiquetas)
+
+    # Misma partición: cada etiqueta corresponde a exactamente una de la referencia
+    assert np.array_equal(etiquetas > 0, referencia > 0)
+    pares = np.unique(np.stack([etiquetas[referencia > 0], referencia[referencia > 0]]), axis=1)
+    assert len(np.unique(pares[0])) == len(np.unique(pares[1])) == pares.shape[1]
+    assert len(componentes) == referencia.max()
+
+    tamanos = sorted(np.bincount(referencia.ravel())[1:].tolist(), reverse=True)
+    assert [componente['voxeles'] for componente in componentes] == tamanos
+
+
+def test_estadisticas_de_cada_componente(tmp_path):
+    volumen = volumen_aleatorio(7)
+    componentes, etiquetas = Segmentacion3D.segmentar(
+        volumen, '1', 127, kernel_size=1, conectividad=26,
+        ruta_etiquetas=str(tmp_path / 'etiquetas.npy'), cortes_por_bloque=4)
+    etiquetas = np.asarray(etiquetas)
+
+    for componente in componentes:
+        z, y, x = np.nonzero(etiquetas == componente['etiqueta'])
+        assert componente['voxeles'] == len(z)
+        assert componente['caja'] == (z.min(), z.max(), y.min(), y.max(), x.min(), x.max())
+        assert np.allclose(componente['centroide'], (z.mean(), y.mean(), x.mean()))
+
+
+def test_volumen_minimo_descarta_componentes_pequenas():
+    volumen = volumen_aleatorio(3)
+    todas, _ = Segmentacion3D.segmentar(volumen, '1', 127, kernel_size=1, conectividad=6,
+                                        cortes_por_bloque=2)
+    grandes, _ = Segmentacion3D.segmentar(volumen, '1', 127, kernel_size=1, conectividad=6,
+                                          volumen_minimo=5, cortes_por_bloque=2)
+
+    assert [c['voxeles'] for c in grandes] == [c['voxeles'] for c in todas if c['voxeles'] >= 5]
@@ -0,0 +1,76 @@
+"""Pruebas de la conversión a 8 bits por tabla de consulta de Ventaneo"""
+
+import numpy as np
+import pytest
+
+from clases import Ventaneo
+
+
+def ventana_de_referencia(valores, pendiente, intercepto, centro, ancho):
+    """Fórmula de ventana lineal de DICOM (PS3.3 C.11.2.1.2) aplicada valor por valor"""
+    reescalados = valores.astype(np.float64) * pendiente + intercepto
+    salida = ((reescalados - (centro - 0.5)) / (ancho - 1) + 0.5) * 255.0
+    return np.clip(np.rint(salida), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('tipo', [np.uint8, np.int16, np.uint16])
+@pytest.mark.parametrize('parametros', [(1.0, 0.0, 40.0, 80.0), (1.0, -1024.0, 400.0, 1800.0),
+                                        (0.5, 10.0, 100.0, 50.0)])
+def test_tabla_igual_a_la_formula(tipo, parametros):
+    info = np.iinfo(tipo)
+    valores = np.random.default_rng(0).integers(info.min, info.max, (32, 48), endpoint=True).astype(tipo)
+
+    convertido = Ventaneo.a_uint8(valores, 'dicom', parametros)
+
+    assert np.array_equal(convertido, ventana_de_referencia(valores, *parametros))
+
+
+def test_tabla_recorre_todos_los_valores_de_16_bits():
+    valores = np.arange(-32768, 32768, dtype=np.int16).reshape(256, 256)
+    parametros = (1.0, -1024.0, 40.0, 400.0)
+
+    assert np.array_equal(Ventaneo.a_uint8(valores, 'dicom', parametros),
+                          ventana_de_referencia(valores, *parametros))
+
+
+def test_presets_y_ventana_por_corte():
+    rng = np.random.default_rng(1)
+    volumen = rng.integers(-2000, 3000, (3, 16, 16)).astype(np.int16)
+    parametros = [(1.0, 0.0, 40.0, 80.0), (1.0, 0.0, 300.0, 1500.0), (2.0, -1024.0, None, None)]
+
+    por_corte = Ventaneo.a_uint8(volumen, 'dicom', parametros)
+    hueso = Ventaneo.a_uint8(volumen, 'hueso', parametros)
+
+    assert np.array_equal(por_corte[0], ventana_de_referencia(volumen[0], *parametros[0]))
+    assert np.array_equal(por_corte[1], ventana_de_referencia(volumen[1], *parametros[1]))
+    for indice, (pendiente, intercepto, _, _) in enumerate(parametros):
+        assert np.array_equal(hueso[indice], ventana_de_referencia(volumen[indice], pendiente, intercepto,
+                                                                   *Ventaneo.PRESETS['hueso']))
+
+
+def test_ventana_completa_no_llena_la_cache_de_tablas():
+    rng = np.random.default_rng(2)
+    Ventaneo._tabla.cache_clear()
+    for _ in range(5):
+        imagen = rng.integers(-1000, 1000, (16, 16)).astype(np.int16)
+        minimo, maximo = float(imagen.min()), float(imagen.max())
+        centro, ancho = (minimo + maximo + 1) / 2, maximo - minimo + 1
+
+        convertido = Ventaneo.a_uint8(imagen, 'completo')
+
+        assert np.array_equal(convertido, ventana_de_referencia(imagen, 1.0, 0.0, centro, ancho))
+    assert Ventaneo._tabla.cache_info().currsize == 0
+
+
+def test_resolver_ventana_fija_la_de_la_imagen_original():
+    original = np.array([[0, 100], [200, 300]], dtype=np.int16)
+    trasladada = np.array([[0, 0], [0, 100]], dtype=np.int16)
+    parametros = (1.0, 0.0, None, None)
+
+    ventana = Ventaneo.resolver_ventana(original, 'completo', parametros)
+
+    assert ventana == (150.5, 301)
+    assert np.array_equal(Ventaneo.a_uint8(trasladada, ventana, parametros),
+                          ventana_de_referencia(trasladada, 1.0, 0.0, *ventana))
+    assert Ventaneo.resolver_ventana(original, 'dicom', (1.0, 0.0, 40.0, 80.0)) == (40.0, 80.0)
+    assert Ventaneo.resolver_ventana(original, 'cerebro') == Ventaneo.PRESETS['cerebro']